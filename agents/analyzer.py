@@ -3,15 +3,247 @@
 使用 Azure OpenAI 理解網頁結構和使用者意圖
 支援 Responses API 和 Completions API 自動切換
 """
-import os
-import json
-from typing import Optional
-from dataclasses import dataclass
-from dotenv import load_dotenv
+import asyncio
+import httpx
+from functools import lru_cache
+from typing import Optional, List, Tuple
+from dataclasses import dataclass, asdict
 
+from agents.config import settings
 from agents.openai_client import AzureOpenAIClient
+from agents.prompt_compress import compress_html
+from agents.cache import ResponseCache, SemanticCache, SingleFlight, make_cache_key, prompt_version, MAX_CACHEABLE_TEMPERATURE
 
-load_dotenv()
+
+# System prompt 必須保持靜態 (不含時間、隨機內容)，並超過 1024 tokens，
+# 才能觸發 Azure OpenAI 的自動 prefix caching
+_SYSTEM_PROMPT = """你是一個網頁爬蟲專家。分析給定的網頁結構，根據使用者的目標，
+找出最佳的資料擷取策略。
+
+## 輸入說明
+- 使用者目標: 使用者想要抓取的資料
+- 網頁標題: 頁面的 <title>
+- 網頁結構: 簡化後的 DOM，每行格式為 `<tag#id.class> 文字`，縮排代表層級深度。
+  script、style、svg、iframe 等元素已移除，文字最多保留前 50 個字元。
+  重複出現的相同結構只保留前 3 個，其餘以「… 另有 N 個相同結構的 <tag>」表示。
+- 網頁截圖 (選用): 目前可視範圍的畫面，用來判斷資料在頁面上的位置
+
+## 分析規則
+1. 先從截圖與網頁結構找出與使用者目標最相關的區塊 (表格、列表、卡片、單一資訊區塊)。
+2. Selector 優先使用穩定的 id 與語意化的 class；避免依賴自動產生的 class
+   (例如 css-1a2b3c、sc-xyz123) 以及過深的 nth-child 位置選擇器。
+3. 表格資料優先使用 table / tr / td 結構；列表資料找出重複出現的項目容器，
+   並給出容器 selector 與項目內各欄位的相對 selector。
+4. suggested_selectors 依重要性排序，第一個是最主要的容器或項目 selector。
+5. data_structure 是每筆資料的欄位清單，name 使用英文 snake_case，
+   type 只能是 string、number、boolean、url 其中之一。
+6. page_type 只能是 table、list、single、other 其中之一。
+7. 若頁面是登入頁、年齡確認頁 (例如 PTT 八卦板的「我同意，我已年滿十八歲」)
+   或其他前導頁面，請在 target_description 中註明需要先處理的步驟
+   (例如帶入 over18=1 cookie)。
+8. 若使用者目標在頁面上找不到，target_description 說明原因，
+   suggested_selectors 回傳空陣列。
+9. 只輸出 JSON，不要輸出任何其他文字，也不要用 markdown 代碼塊包住。
+
+## 輸出 JSON 格式
+{
+    "target_description": "描述要抓取的內容",
+    "suggested_selectors": ["CSS selector 1", "CSS selector 2"],
+    "data_structure": [{"name": "field1", "type": "string"}, {"name": "field2", "type": "number"}],
+    "page_type": "table|list|single|other"
+}
+
+## 範例 1 (表格)
+使用者目標: 抓取美元指數和美元日圓的價格
+網頁標題: StockQ 國際股市指數
+網頁結構:
+<body>
+  <div#wrapper>
+    <table.marketdatatable> 美元指數 98.42 +0.15
+      <tr> 美元指數 98.42 +0.15
+        <td> 美元指數
+        <td> 98.42
+        <td> +0.15
+      <tr> 美元日圓 156.30 -0.22
+        <td> 美元日圓
+        <td> 156.30
+        <td> -0.22
+輸出:
+{
+    "target_description": "StockQ 匯率表格中『美元指數』與『美元日圓』兩列的名稱、價格與漲跌",
+    "suggested_selectors": ["table.marketdatatable tr", "table.marketdatatable tr td"],
+    "data_structure": [
+        {"name": "name", "type": "string"},
+        {"name": "price", "type": "number"},
+        {"name": "change", "type": "number"}
+    ],
+    "page_type": "table"
+}
+
+## 範例 2 (列表)
+使用者目標: 抓取最新文章的標題、作者和連結
+網頁標題: 看板 Gossiping 文章列表 - 批踢踢實業坊
+網頁結構:
+<body>
+  <div#main-container>
+    <div.r-list-container>
+      <div.r-ent> [問卦] 有沒有今天很冷的八卦 user123 1/04
+        <div.title> [問卦] 有沒有今天很冷的八卦
+          <a> [問卦] 有沒有今天很冷的八卦
+        <div.meta> user123 1/04
+          <div.author> user123
+          <div.date> 1/04
+輸出:
+{
+    "target_description": "PTT 八卦板文章列表中每篇文章的標題、作者、日期與連結；需帶入 over18=1 cookie 略過年齡確認頁",
+    "suggested_selectors": ["div.r-ent", "div.r-ent div.title a", "div.r-ent div.meta div.author", "div.r-ent div.meta div.date"],
+    "data_structure": [
+        {"name": "title", "type": "string"},
+        {"name": "author", "type": "string"},
+        {"name": "date", "type": "string"},
+        {"name": "link", "type": "url"}
+    ],
+    "page_type": "list"
+}
+
+## 範例 3 (單頁)
+使用者目標: 取得這個專案的星星數和描述
+網頁標題: GitHub - breezy89757/SmartScraper
+網頁結構:
+<body>
+  <div.application-main>
+    <p.f4> AI-powered tool designed to generate, execute, and refine Python web scrapers
+    <a#repo-stars-counter-star.Counter> 128
+輸出:
+{
+    "target_description": "GitHub 專案頁面的簡介文字與星星數",
+    "suggested_selectors": ["#repo-stars-counter-star", "p.f4"],
+    "data_structure": [
+        {"name": "description", "type": "string"},
+        {"name": "stars", "type": "number"}
+    ],
+    "page_type": "single"
+}
+
+請根據以上規則分析使用者提供的網頁，並只輸出 JSON。"""
+
+# 批次模式: 一次呼叫分析多個網頁 (同樣保持靜態以命中 prefix cache)
+_BATCH_SYSTEM_PROMPT = _SYSTEM_PROMPT + """
+
+## 批次模式
+使用者可能一次提供多個網頁，以 `---PAGE {i}---` 分隔 (i 從 0 開始)。
+請對每個網頁各自套用以上規則，輸出：
+{"pages": [ {"page": 0, 第 0 頁的分析結果}, {"page": 1, 第 1 頁的分析結果}, ... ]}
+每個結果的 page 必須是對應網頁 `---PAGE {i}---` 的 i，每個網頁只輸出一個結果。"""
+
+# Structured Outputs (strict) 的 schema：每個物件都必須列出全部欄位且不可有額外欄位，
+# 無法表達任意 key 的 dict，所以 data_structure 以 [{name, type}] 清單輸出，解析後再轉回 dict
+ANALYSIS_SCHEMA = {
+    "name": "AnalysisResult",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "target_description": {"type": "string"},
+            "suggested_selectors": {"type": "array", "items": {"type": "string"}},
+            "data_structure": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "type": {"type": "string", "enum": ["string", "number", "boolean", "url"]}
+                    },
+                    "required": ["name", "type"],
+                    "additionalProperties": False
+                }
+            },
+            "page_type": {"type": "string", "enum": ["table", "list", "single", "other"]}
+        },
+        "required": ["target_description", "suggested_selectors", "data_structure", "page_type"],
+        "additionalProperties": False
+    }
+}
+
+BATCH_ANALYSIS_SCHEMA = {
+    "name": "AnalysisBatch",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "pages": {
+                "type": "array",
+                # 每頁的結果另外帶 page (對應 ---PAGE n--- 的 n)，不依賴陣列位置
+                "items": {
+                    **ANALYSIS_SCHEMA["schema"],
+                    "properties": {"page": {"type": "integer"}, **ANALYSIS_SCHEMA["schema"]["properties"]},
+                    "required": ["page", *ANALYSIS_SCHEMA["schema"]["required"]]
+                }
+            }
+        },
+        "required": ["pages"],
+        "additionalProperties": False
+    }
+}
+
+# 單頁分析的 HTML token 預算 (300 個元素的簡化 DOM 通常在此範圍內)
+HTML_TOKEN_BUDGET = 6000
+
+# 批次模式每頁 HTML token 預算 (約 3000 字元) 與每批總字元上限
+# (超過後 prompt 過長，單次呼叫的吞吐量不再提升)
+BATCH_HTML_TOKENS = 1000
+BATCH_MAX_CHARS = 40000
+
+_encoder = None  # tiktoken encoder，None 表示尚未載入，False 表示無法使用
+
+
+def _count_tokens(text: str) -> int:
+    """計算 token 數 (無 tiktoken 或無法下載編碼檔時以 UTF-8 位元組數粗估)"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.encoding_for_model("gpt-4o")
+        except Exception as e:
+            print(f"⚠️ tiktoken 無法使用: {e}，改用字元數估算")
+            _encoder = False
+    
+    if _encoder:
+        return len(_encoder.encode(text))
+    # 中文約 1 字 (3 bytes) 1 token，英文約 3~4 字元 1 token
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+@lru_cache(maxsize=128)
+def _fit_to_budget(text: str, max_tokens: int = HTML_TOKEN_BUDGET) -> str:
+    """
+    將簡化 HTML 裁切到 token 預算內
+    以行為單位 (每行一個元素)，不會從標籤中間截斷
+    """
+    if _count_tokens(text) <= max_tokens:
+        return text
+    
+    kept = []
+    used = 0
+    for line in text.split("\n"):
+        used += _count_tokens(line) + 1  # +1: 換行
+        if used > max_tokens:
+            break
+        kept.append(line)
+    return "\n".join(kept)
+
+
+@lru_cache(maxsize=256)
+def _build_user_prompt(page_title: str, user_goal: str, html: str) -> str:
+    """
+    組出 user prompt (只含動態內容)
+    同一頁面重複分析時直接取回同一字串，送出的 prompt 逐位元組相同
+    """
+    return f"""使用者目標: {user_goal}
+網頁標題: {page_title}
+
+網頁結構:
+{html}"""
 
 
 @dataclass
@@ -25,22 +257,47 @@ class AnalysisResult:
     usage: Optional[dict] = None # Token 用量
 
 
+def _to_result(data: dict, usage: Optional[dict] = None) -> AnalysisResult:
+    """將符合 ANALYSIS_SCHEMA 的回應轉為 AnalysisResult (欄位清單轉回 dict)"""
+    return AnalysisResult(
+        target_description=data["target_description"],
+        suggested_selectors=[sel for sel in data["suggested_selectors"] if sel],
+        data_structure={field["name"]: field["type"] for field in data["data_structure"]},
+        page_type=data["page_type"],
+        usage=usage
+    )
+
+
 class PageAnalyzer:
     """
     頁面分析 Agent
     使用 Azure OpenAI 分析網頁結構
     """
     
-    def __init__(self):
-        deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-5.2-chat")
-        self._client = AzureOpenAIClient(deployment=deployment)
+    def __init__(self, client: Optional[AzureOpenAIClient] = None):
+        """
+        Args:
+            client: 共用的 AzureOpenAIClient (由呼叫端負責關閉)，未提供時自行建立
+        """
+        self._owns_client = client is None
+        self._client = client or AzureOpenAIClient(deployment=settings.chat_deployment)
+        self._cache = ResponseCache("analyzer", ttl=3600)
+        self._semantic = SemanticCache("analyzer")
+        self._flight = SingleFlight()
+        # 快取 key 的版本：prompt、schema 或 deployment 改變時舊結果自動失效
+        self._cache_version = prompt_version(
+            _SYSTEM_PROMPT, _BATCH_SYSTEM_PROMPT,
+            ANALYSIS_SCHEMA, BATCH_ANALYSIS_SCHEMA,
+            self._client.deployment
+        )
     
     async def analyze(
         self,
         user_goal: str,
         page_title: str,
         simplified_html: str,
-        screenshot_base64: Optional[str] = None
+        screenshot_base64: Optional[str] = None,
+        url: str = ""
     ) -> AnalysisResult:
         """
         分析網頁並理解使用者意圖
@@ -50,34 +307,71 @@ class PageAnalyzer:
             page_title: 網頁標題
             simplified_html: 簡化的 HTML 結構
             screenshot_base64: 截圖 (用於 Vision 分析)
+            url: 網頁網址 (語意快取只在同一網址、同一頁面內容時命中)
         
         Returns:
             AnalysisResult
         """
-        # 建構 prompt
-        system_prompt = """你是一個網頁爬蟲專家。分析給定的網頁結構，根據使用者的目標，
-找出最佳的資料擷取策略。
-
-你需要輸出 JSON 格式：
-{
-    "target_description": "描述要抓取的內容",
-    "suggested_selectors": ["CSS selector 1", "CSS selector 2"],
-    "data_structure": {"field1": "string", "field2": "number"},
-    "page_type": "table|list|single|other"
-}"""
-
-        user_prompt = f"""網頁標題: {page_title}
-
-使用者目標: {user_goal}
-
-網頁結構:
-{simplified_html[:60000]}
-
-請分析並給出 JSON 格式的回應。"""
+        temperature = 0.3
+        html = _fit_to_budget(compress_html(simplified_html))
+        
+        # 檢查快取 (相同目標 + 相同頁面結構)
+        use_cache = temperature <= MAX_CACHEABLE_TEMPERATURE
+        cache_key = make_cache_key({
+            "g": user_goal,
+            "t": page_title,
+            "h": html,
+            "v": bool(screenshot_base64)
+        }, self._cache_version)
+        if use_cache:
+            cached = self._cache.get(cache_key)
+            if cached:
+                print("⚡ Analyzer 快取命中")
+                return AnalysisResult(**cached)
+        
+        # 語意快取的範圍：目標可以改寫，但網址與頁面內容必須相同
+        semantic_scope = make_cache_key({
+            "u": url,
+            "t": page_title,
+            "h": html,
+            "v": bool(screenshot_base64)
+        }, self._cache_version)
+        
+        # 相同請求同時進行時只呼叫一次 API (single-flight)
+        return await self._flight.do(
+            cache_key,
+            lambda: self._analyze(
+                user_goal, page_title, html, screenshot_base64,
+                temperature, cache_key, semantic_scope, use_cache
+            )
+        )
+    
+    async def _analyze(
+        self,
+        user_goal: str,
+        page_title: str,
+        html: str,
+        screenshot_base64: Optional[str],
+        temperature: float,
+        cache_key: str,
+        semantic_scope: str,
+        use_cache: bool
+    ) -> AnalysisResult:
+        """快取未命中時的分析流程: 語意快取 → 呼叫 API → 寫入快取"""
+        # 語意快取 (改寫過的目標，需啟用 SMARTSCRAPER_SEMANTIC_CACHE)
+        if use_cache and self._semantic.enabled:
+            cached = await asyncio.to_thread(self._semantic.get, user_goal, semantic_scope)
+            if cached:
+                print("🧠 Analyzer 語意快取命中")
+                return AnalysisResult(**cached)
+        
+        # 靜態指示都在 system prompt，動態內容只放在 user prompt 最後，
+        # 讓前段 token 每次都完全相同以命中 Azure OpenAI 自動 prefix cache
+        user_prompt = _build_user_prompt(page_title, user_goal, html)
 
         # 建構 messages
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": _SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
         
@@ -90,56 +384,133 @@ class PageAnalyzer:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{screenshot_base64}"
+                            "url": f"data:image/jpeg;base64,{screenshot_base64}"
                         }
                     }
                 ]
             }
         
-        # 呼叫 API (自動選擇)
+        # Structured Outputs 保證回應符合 ANALYSIS_SCHEMA (走 Completions API)
         response = await self._client.chat(
             messages=messages,
-            temperature=0.3,
-            json_mode=True
+            temperature=temperature,
+            response_schema=ANALYSIS_SCHEMA
         )
         
-        # 解析回應 - 嘗試提取 JSON
-        content = response.content.strip()
+        result = _to_result(response.json(), response.usage)
         
-        # 嘗試直接解析
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            # 嘗試從 markdown 代碼塊提取
-            import re
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(1))
+        if use_cache:
+            cached = {**asdict(result), "usage": None}
+            self._cache.set(cache_key, cached)
+            if self._semantic.enabled:
+                await asyncio.to_thread(self._semantic.set, user_goal, semantic_scope, cached)
+        
+        return result
+    
+    async def analyze_batch(
+        self,
+        items: List[Tuple[str, str, str]]
+    ) -> List[AnalysisResult]:
+        """
+        批次分析多個網頁，每批只呼叫一次 API
+        
+        Args:
+            items: (user_goal, page_title, simplified_html) 清單
+        
+        Returns:
+            與 items 順序相同的 AnalysisResult 清單
+            (每批的 Token 用量只記在該批第一筆結果)
+        """
+        results: List[Optional[AnalysisResult]] = [None] * len(items)
+        htmls = []
+        keys = []
+        
+        # 先查快取，只把未命中的頁面送出
+        pending = []
+        for i, (user_goal, page_title, simplified_html) in enumerate(items):
+            html = _fit_to_budget(compress_html(simplified_html), BATCH_HTML_TOKENS)
+            htmls.append(html)
+            key = make_cache_key({"g": user_goal, "t": page_title, "h": html, "v": False}, self._cache_version)
+            keys.append(key)
+            cached = self._cache.get(key)
+            if cached:
+                results[i] = AnalysisResult(**cached)
             else:
-                # 嘗試找任何 JSON 物件
-                json_match = re.search(r'\{[^{}]*"target_description"[^{}]*\}', content, re.DOTALL)
-                if json_match:
-                    data = json.loads(json_match.group(0))
-                else:
-                    # 返回預設值
-                    print(f"⚠️ 無法解析回應: {content[:200]}")
-                    data = {
-                        "target_description": "無法解析",
-                        "suggested_selectors": [],
-                        "data_structure": {},
-                        "page_type": "other"
-                    }
+                pending.append(i)
         
-        return AnalysisResult(
-            target_description=data.get("target_description", ""),
-            suggested_selectors=data.get("suggested_selectors", []),
-            data_structure=data.get("data_structure", {}),
-            page_type=data.get("page_type", "other"),
-            usage=response.usage
-        )
+        if len(pending) < len(items):
+            print(f"⚡ Analyzer 批次快取命中 {len(items) - len(pending)}/{len(items)}")
+        
+        # 依總字元數切批
+        batches = []
+        batch, size = [], 0
+        for i in pending:
+            html_len = len(htmls[i])
+            if batch and size + html_len > BATCH_MAX_CHARS:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(i)
+            size += html_len
+        if batch:
+            batches.append(batch)
+        
+        async def run(batch: List[int]) -> None:
+            pages = "\n".join(
+                f"---PAGE {n}---\n" + _build_user_prompt(items[i][1], items[i][0], htmls[i])
+                for n, i in enumerate(batch)
+            )
+            try:
+                response = await self._client.chat(
+                    messages=[
+                        {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"以下共 {len(batch)} 個網頁:\n{pages}"}
+                    ],
+                    temperature=0.3,
+                    response_schema=BATCH_ANALYSIS_SCHEMA
+                )
+                
+                # 依 page 對應回輸入的網頁；超出範圍或重複的 page 無法確定屬於哪一頁，一律捨棄
+                by_page = {}
+                duplicated = set()
+                for data in response.json()["pages"]:
+                    n = data["page"]
+                    if n in by_page:
+                        duplicated.add(n)
+                    elif 0 <= n < len(batch):
+                        by_page[n] = data
+            except (ValueError, TypeError, KeyError, httpx.HTTPError, asyncio.TimeoutError) as e:
+                # 拒絕回答、空回應或重試後仍失敗：這批的頁面維持 None，不影響其他批次
+                print(f"⚠️ 批次分析失敗 ({len(batch)} 頁): {type(e).__name__}: {e}")
+                return
+            
+            usage = response.usage
+            for n, data in sorted(by_page.items()):
+                if n in duplicated:
+                    continue
+                i = batch[n]
+                results[i] = _to_result(data, usage)
+                usage = None  # Token 用量只記在第一筆
+                self._cache.set(keys[i], {**asdict(results[i]), "usage": None})
+        
+        await asyncio.gather(*(run(batch) for batch in batches))
+        
+        # 批次失敗或回應缺漏的頁面改為單頁分析
+        for i, result in enumerate(results):
+            if result is None:
+                print(f"⚠️ 批次結果缺少第 {i} 頁，改為單頁分析")
+                results[i] = await self.analyze(*items[i])
+        
+        return results
+    
+    async def warmup(self) -> None:
+        """預先建立 API 連線 (可與網頁載入並行)"""
+        await self._client.warmup()
     
     async def close(self):
-        await self._client.close()
+        if self._owns_client:
+            await self._client.close()
+        self._cache.close()
+        self._semantic.close()
 
 
 # 測試
@@ -160,5 +531,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
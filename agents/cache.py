@@ -0,0 +1,304 @@
+"""
+LLM 回應快取
+相同的請求 (完全比對) 直接回傳先前的結果，省下一次 Azure OpenAI 往返
+記憶體 LRU 在前、SQLite 在後，不需額外套件
+"""
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable
+
+from agents.config import settings
+
+
+DEFAULT_CACHE_DIR = Path.home() / ".smartscraper" / "cache"
+
+# temperature 高於此值時結果變異大，不快取
+MAX_CACHEABLE_TEMPERATURE = 0.3
+
+# 記憶體快取筆數上限 (每個 namespace)
+MEMORY_CACHE_SIZE = 1024
+
+
+def prompt_version(*parts: Any) -> str:
+    """
+    system prompt、schema、deployment 等固定設定的雜湊
+    加進快取 key，改版後舊的快取結果 (磁碟上跨版本保留) 不會再被使用
+    """
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(payload: Dict[str, Any], version: str = "") -> str:
+    """將請求內容正規化後取 SHA-256 (version 由 prompt_version() 產生)"""
+    raw = json.dumps([version, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    完全比對快取
+    以 (namespace, key) 為索引，value 為 JSON 序列化後的結果 dict
+    熱門的 key 另外保留在記憶體 LRU，命中時不必查 SQLite 與反序列化
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: int = 3600,
+        cache_dir: Optional[Path] = None
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.enabled = settings.cache_enabled
+        self._conn: Optional[sqlite3.Connection] = None
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        if self.enabled:
+            cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(
+                str(cache_dir / "responses.db"),
+                check_same_thread=False
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """取得快取結果，過期或不存在時回傳 None"""
+        if not self._conn:
+            return None
+
+        entry = self._memory.get(key)
+        if entry:
+            expires_at, value = entry
+            if expires_at >= time.time():
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM responses WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if not row:
+            return None
+
+        value, expires_at = row
+        if expires_at < time.time():
+            self._conn.execute(
+                "DELETE FROM responses WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            )
+            self._conn.commit()
+            return None
+
+        value = json.loads(value)
+        self._remember(key, value, expires_at)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """寫入快取"""
+        if not self._conn:
+            return
+
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, value: Dict[str, Any], expires_at: float) -> None:
+        """放入記憶體 LRU，超過上限時淘汰最久未使用的項目"""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def close(self) -> None:
+        self._memory.clear()
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+
+class SingleFlight:
+    """
+    合併相同 key 的並行請求
+    同一時間只有第一個請求會真正執行，其餘等待並取得同一個結果
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield: 單一呼叫端被取消時不影響其他等待者
+        return await asyncio.shield(task)
+
+
+class SemanticCache:
+    """
+    語意快取
+    以 embedding 餘弦相似度比對改寫過的使用者目標 (e.g. 「抓取美元指數」vs「取得美元指數價格」)
+    只有 scope 相同 (同一網址、同一頁面內容、同一版本) 的項目才會命中，
+    避免標題相同的不同網站 (e.g. 都叫「Home」) 拿到彼此的結果
+    需安裝選用套件: uv sync --extra semantic，並設定 SMARTSCRAPER_SEMANTIC_CACHE=1
+    """
+
+    MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+
+    # 每次查詢取回的候選數 (相似但 scope 不同或已過期的項目會被略過)
+    SEARCH_K = 8
+
+    def __init__(
+        self,
+        namespace: str,
+        threshold: float = 0.93,
+        ttl: int = 86400,
+        cache_dir: Optional[Path] = None
+    ):
+        self.namespace = namespace
+        self.threshold = threshold
+        self.ttl = ttl
+        self.enabled = settings.semantic_cache_enabled
+        self._cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+
+        self._available = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._model = None
+        self._index = None
+        self._entries: List[Tuple[str, float, Dict[str, Any]]] = []  # (scope, expires_at, value)，與索引 id 對應
+        # get / set 由 asyncio.to_thread 並行呼叫，索引與 _entries 必須一起更新
+        self._lock = threading.Lock()
+
+    def _init(self) -> bool:
+        """延遲載入 embedding 模型與 FAISS 索引 (呼叫端需持有 _lock)"""
+        if self._available is not None:
+            return self._available
+
+        try:
+            import numpy as np
+            import faiss
+            from sentence_transformers import SentenceTransformer
+
+            self._np = np
+            self._model = SentenceTransformer(self.MODEL_NAME)
+            self._index = faiss.IndexFlatIP(self._model.get_sentence_embedding_dimension())
+
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(
+                str(self._cache_dir / "semantic.db"),
+                check_same_thread=False
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(semantic)")}
+            if columns and "scope" not in columns:
+                # 舊格式沒有 scope，無法判斷屬於哪個頁面，直接捨棄
+                self._conn.execute("DROP TABLE semantic")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS semantic (
+                    namespace TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("DELETE FROM semantic WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+            # 從磁碟重建索引
+            rows = self._conn.execute(
+                "SELECT vector, scope, value, expires_at FROM semantic WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchall()
+            if rows:
+                vectors = np.stack([np.frombuffer(v, dtype="float32") for v, _, _, _ in rows])
+                self._index.add(vectors)
+                self._entries = [
+                    (scope, expires_at, json.loads(value))
+                    for _, scope, value, expires_at in rows
+                ]
+
+            self._available = True
+            print(f"🧠 語意快取: 可用 ({len(self._entries)} 筆)")
+
+        except Exception as e:
+            print(f"⚠️ 語意快取初始化失敗: {e}，停用")
+            self._available = False
+
+        return self._available
+
+    def _embed(self, text: str):
+        vec = self._model.encode([text], normalize_embeddings=True)
+        return self._np.asarray(vec, dtype="float32")
+
+    def get(self, text: str, scope: str) -> Optional[Dict[str, Any]]:
+        """
+        找出同一 scope 中最相似且未過期的快取結果，相似度未達門檻時回傳 None
+
+        Args:
+            text: 比對語意的文字 (使用者目標)
+            scope: 必須完全相同才會命中 (e.g. 網址與頁面內容的雜湊)
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if not self._init() or self._index.ntotal == 0:
+                return None
+
+            now = time.time()
+            scores, ids = self._index.search(self._embed(text), min(self.SEARCH_K, self._index.ntotal))
+            # 結果依相似度由高到低排列
+            for score, idx in zip(scores[0], ids[0]):
+                if score < self.threshold:
+                    break
+                entry_scope, expires_at, value = self._entries[idx]
+                if entry_scope == scope and expires_at >= now:
+                    return value
+        return None
+
+    def set(self, text: str, scope: str, value: Dict[str, Any]) -> None:
+        """加入索引並寫入磁碟"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if not self._init():
+                return
+
+            vec = self._embed(text)
+            expires_at = time.time() + self.ttl
+            self._index.add(vec)
+            self._entries.append((scope, expires_at, value))
+            self._conn.execute(
+                "INSERT INTO semantic (namespace, scope, vector, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, scope, vec[0].tobytes(), json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
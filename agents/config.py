@@ -0,0 +1,38 @@
+"""
+設定
+啟動時讀取一次 .env 與環境變數，其餘模組直接使用 settings
+"""
+import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@dataclass(frozen=True)
+class Settings:
+    """環境設定 (import 時建立，之後不再讀取環境變數)"""
+    endpoint: str
+    api_key: str
+    api_version: str
+    chat_deployment: str
+    codex_deployment: str
+    cache_enabled: bool
+    semantic_cache_enabled: bool
+    workers: int
+
+
+def _load_settings() -> Settings:
+    return Settings(
+        endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", "").rstrip("/"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY", ""),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2025-04-01-preview"),
+        chat_deployment=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-5.2-chat"),
+        codex_deployment=os.getenv("AZURE_OPENAI_CODEX_DEPLOYMENT", "gpt-5.1-codex-max"),
+        cache_enabled=os.getenv("SMARTSCRAPER_CACHE", "1") != "0",
+        semantic_cache_enabled=os.getenv("SMARTSCRAPER_SEMANTIC_CACHE", "0") == "1",
+        workers=int(os.getenv("SMARTSCRAPER_WORKERS", "1"))
+    )
+
+
+settings = _load_settings()
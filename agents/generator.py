@@ -3,15 +3,254 @@
 使用 Codex 模型生成 Python 爬蟲程式碼
 支援 Responses API 和 Completions API 自動切換
 """
-import os
 import json
+from functools import lru_cache
 from typing import Optional
-from dataclasses import dataclass
-from dotenv import load_dotenv
+from dataclasses import dataclass, asdict
 
+from agents.config import settings
 from agents.openai_client import AzureOpenAIClient
+from agents.cache import ResponseCache, SingleFlight, make_cache_key, prompt_version, MAX_CACHEABLE_TEMPERATURE
 
-load_dotenv()
+# 回應中 python 代碼塊的開頭
+_PY_FENCE = "```python"
+
+
+def _extract_code(content: str) -> str:
+    """取出 ```python 代碼塊的內容 (以 str.partition 線性掃描)，沒有代碼塊時回傳原文"""
+    _, fence, rest = content.partition(_PY_FENCE)
+    if not fence:
+        return content
+    # 缺少結尾 ``` (回應被截斷) 時取到結尾為止
+    code, _, _ = rest.partition("```")
+    return code.strip()
+
+
+# 兩個 system prompt 都保持靜態並超過 1024 tokens，
+# 才能觸發 Azure OpenAI 的自動 prefix caching
+
+# 沙箱規則，生成與修正共用
+_SANDBOX_RULES = """## 沙箱限制
+程式碼會在受限的沙箱中執行：
+- 只能 import: httpx, asyncio, requests, bs4, lxml, json, re, datetime, time, typing, collections,
+  urllib (含 urllib.parse / urllib.request / urllib.error), math, random
+- 禁止使用: os, subprocess, socket, eval(), exec(), compile(), open(), input(),
+  globals(), locals(), getattr(), setattr(), delattr(), breakpoint()
+- 沙箱會先以字串比對拒絕含有 "os."、"subprocess"、"socket"、"eval("、"exec(" 的程式碼 (包含變數名稱與字串)，
+  例如 photos.append() 也會被拒絕，請改用 photo_list 這類名稱
+- 禁止使用底線開頭的名稱與屬性 (例如 _helper、__name__、obj._private)，自訂函數與變數請不要以底線開頭；
+  單獨的 _ 可作為捨棄用的變數
+- 禁止存取執行外部程式的屬性: system、popen、Popen、fork、exec*/spawn* 系列 (e.g. execv、spawnl)、
+  posix_spawn、create_subprocess_exec / create_subprocess_shell (一般變數名稱如 executor、system_name 不受影響)
+- 不可讀寫檔案，結果一律以 return 回傳
+- 沙箱會呼叫 scrape(url) 並取得回傳值 (async def 會以 asyncio.run 執行)，不需要在程式中自行呼叫"""
+
+# 爬蟲範例，讓輸出風格一致
+_SCRAPER_EXAMPLE = """## 範例程式碼
+```python
+import httpx
+from bs4 import BeautifulSoup
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+}
+
+
+def parse_number(text):
+    try:
+        return float(text.replace(",", "").strip())
+    except (ValueError, AttributeError):
+        return None
+
+
+async def scrape(url):
+    try:
+        async with httpx.AsyncClient(headers=HEADERS, timeout=10, follow_redirects=True) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        return [{"error": str(e)}]
+
+    # 傳入 bytes，讓 BeautifulSoup 依 <meta charset> 判斷編碼
+    soup = BeautifulSoup(response.content, "lxml")
+    results = []
+    for row in soup.select("table.marketdatatable tr"):
+        cells = [td.get_text(strip=True) for td in row.select("td")]
+        if len(cells) < 3:
+            continue
+        results.append({
+            "name": cells[0],
+            "price": parse_number(cells[1]),
+            "change": parse_number(cells[2]),
+        })
+    return results
+```
+
+多頁列表 (需要 cookie、將相對連結轉為絕對網址，並以 asyncio.gather 並行抓取前幾頁):
+```python
+import re
+import asyncio
+import httpx
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
+COOKIES = {"over18": "1"}
+MAX_PAGES = 3
+CONCURRENCY = 5
+
+
+def parse_entries(html, base_url):
+    soup = BeautifulSoup(html, "lxml")
+    results = []
+    for entry in soup.select("div.r-ent"):
+        link = entry.select_one("div.title a")
+        if not link:
+            continue  # 已刪除的文章沒有連結
+        author = entry.select_one("div.meta div.author")
+        date = entry.select_one("div.meta div.date")
+        results.append({
+            "title": link.get_text(strip=True),
+            "author": author.get_text(strip=True) if author else None,
+            "date": date.get_text(strip=True) if date else None,
+            "link": urljoin(base_url, link.get("href", "")),
+        })
+    return results
+
+
+async def fetch(client, semaphore, url):
+    async with semaphore:  # 限制同時連線數，避免對網站造成負擔
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.text
+
+
+async def scrape(url):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(headers=HEADERS, cookies=COOKIES, timeout=10, follow_redirects=True) as client:
+        try:
+            first = await fetch(client, semaphore, url)
+        except httpx.HTTPError as e:
+            return [{"error": str(e)}]
+
+        # 由「上頁」連結 (index{N}.html) 推算前幾頁的網址，一次並行抓取
+        soup = BeautifulSoup(first, "lxml")
+        prev = next((a for a in soup.select("div.btn-group-paging a[href]") if "上頁" in a.get_text()), None)
+        match = re.search(r"index(\\d+)\\.html", prev["href"]) if prev else None
+        page_urls = []
+        if match:
+            last = int(match.group(1))
+            page_urls = [urljoin(url, f"index{n}.html") for n in range(last, last - MAX_PAGES + 1, -1)]
+        pages = await asyncio.gather(
+            *(fetch(client, semaphore, page_url) for page_url in page_urls),
+            return_exceptions=True
+        )
+
+    results = parse_entries(first, url)
+    for page_url, html in zip(page_urls, pages):
+        if isinstance(html, Exception):
+            continue  # 單頁失敗不影響其他頁
+        results.extend(parse_entries(html, page_url))
+    return results
+```"""
+
+_GENERATE_SYSTEM_PROMPT = """你是一個 Python 爬蟲專家。根據給定的網頁資訊，生成可執行的爬蟲程式碼。
+
+## 輸入說明
+- 目標網址: 要抓取的頁面
+- 抓取目標: 分析 Agent 整理的抓取內容描述
+- 建議的 CSS Selectors: 依重要性排序的 selector 清單 (JSON 陣列)
+- 資料結構: 每筆資料的欄位與型別 (JSON 物件)
+- 頁面類型: table、list、single 或 other
+
+## 規則
+1. 使用 httpx.AsyncClient + BeautifulSoup，parser 一律用 "lxml" (比 html.parser 快數倍)
+2. 程式碼必須是完整可執行的
+3. 輸出 JSON 格式：
+{
+    "code": "完整的 Python 程式碼",
+    "imports": ["import 語句列表"],
+    "explanation": "程式碼說明"
+}
+4. 程式碼中定義一個 async def scrape(url) 函數，回傳 list[dict]，每個 dict 的欄位依照資料結構
+5. 加入錯誤處理：網路錯誤、找不到元素、數值轉換失敗都不可讓程式崩潰
+6. 不要使用任何危險函數 (exec, eval, os.system 等)
+7. 加入瀏覽器 User-Agent header，並設定 timeout
+8. 中文網站請將 response.content (bytes) 交給 BeautifulSoup，由 <meta charset> 判斷編碼
+9. 若抓取目標提到需要 cookie (例如 PTT 的 over18=1)，在 httpx.AsyncClient 帶入 cookies
+10. 數值欄位去除千分位逗號與百分比符號後轉為 float，失敗時回傳 None
+11. 只輸出 JSON，不要用 markdown 代碼塊包住
+12. 需要抓取多個網址時 (分頁、詳細頁)，用 asyncio.gather 並行抓取，
+    並以 asyncio.Semaphore 限制同時連線數 (5 以內)
+
+""" + _SANDBOX_RULES + """
+
+""" + _SCRAPER_EXAMPLE
+
+_FIX_SYSTEM_PROMPT = """你是一個 Python 爬蟲專家。使用者的爬蟲程式碼執行後返回空結果或錯誤。
+請分析問題並修正程式碼。
+
+## 輸入說明
+- 目標網址與使用者目標
+- 原始程式碼
+- 執行結果: 沙箱回傳的資料、錯誤訊息或 stdout
+- 使用者額外指示 (Feedback): 使用者補充的需求，可能為「無」
+
+## 規則
+1. 保持 scrape(url) 函數結構
+2. 修正 CSS selector 或資料提取邏輯
+3. 只輸出修正後的完整程式碼，不要解釋
+4. 使用 httpx.AsyncClient + BeautifulSoup (async def scrape，parser 用 "lxml")
+5. 優先參考使用者的額外指示（如果有的話）
+
+## 修正方向
+1. 若結果為 Null/空，請檢查 CSS Selector：改用更寬鬆的 selector、
+   確認元素是否由 JavaScript 動態產生、確認是否被年齡確認或登入頁擋住。
+2. 若有 Exception，請修復語法或邏輯。
+3. 若出現亂碼，將 response.content (bytes) 交給 BeautifulSoup 判斷編碼。
+4. 若回傳 403 或被阻擋，加入瀏覽器 User-Agent header。
+5. 確保符合沙箱安全限制 (僅用 httpx, asyncio, bs4, lxml, urllib, json 等白名單模組)。
+
+""" + _SANDBOX_RULES + """
+
+""" + _SCRAPER_EXAMPLE
+
+
+# Structured Outputs (strict) 的 schema，對應 GeneratedCode
+GENERATED_CODE_SCHEMA = {
+    "name": "GeneratedCode",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "code": {"type": "string"},
+            "imports": {"type": "array", "items": {"type": "string"}},
+            "explanation": {"type": "string"}
+        },
+        "required": ["code", "imports", "explanation"],
+        "additionalProperties": False
+    }
+}
+
+
+@lru_cache(maxsize=256)
+def _build_prompt(
+    url: str,
+    target_description: str,
+    selectors: tuple,
+    structure_json: str,
+    page_type: str
+) -> str:
+    """
+    組出生成用的 user prompt (只含動態內容)
+    參數需可雜湊: selectors 為保留原順序的 tuple，資料結構為 sort_keys 序列化後的 JSON
+    """
+    return f"""目標網址: {url}
+抓取目標: {target_description}
+建議的 CSS Selectors: {json.dumps(list(selectors), ensure_ascii=False)}
+資料結構: {structure_json}
+頁面類型: {page_type}"""
 
 
 @dataclass
@@ -29,9 +268,19 @@ class ScraperGenerator:
     使用 Azure OpenAI Codex 生成 Python 程式碼
     """
     
-    def __init__(self):
-        deployment = os.getenv("AZURE_OPENAI_CODEX_DEPLOYMENT", "gpt-5.1-codex-max")
-        self._client = AzureOpenAIClient(deployment=deployment)
+    def __init__(self, client: Optional[AzureOpenAIClient] = None):
+        """
+        Args:
+            client: 共用的 AzureOpenAIClient (由呼叫端負責關閉)，未提供時自行建立
+        """
+        self._owns_client = client is None
+        self._client = client or AzureOpenAIClient(deployment=settings.codex_deployment)
+        self._cache = ResponseCache("generator", ttl=86400)
+        self._flight = SingleFlight()
+        # 快取 key 的版本：prompt、schema 或 deployment 改變時舊結果自動失效
+        self._cache_version = prompt_version(
+            _GENERATE_SYSTEM_PROMPT, GENERATED_CODE_SCHEMA, self._client.deployment
+        )
     
     async def generate(
         self,
@@ -54,81 +303,82 @@ class ScraperGenerator:
         Returns:
             GeneratedCode
         """
-        system_prompt = """你是一個 Python 爬蟲專家。根據給定的網頁資訊，生成可執行的爬蟲程式碼。
-
-規則：
-1. 使用 requests + BeautifulSoup
-2. 程式碼必須是完整可執行的
-3. 輸出 JSON 格式：
-{
-    "code": "完整的 Python 程式碼",
-    "imports": ["import 語句列表"],
-    "explanation": "程式碼說明"
-}
-4. 程式碼中定義一個 scrape(url) 函數，回傳 list[dict]
-5. 加入錯誤處理
-6. 不要使用任何危險函數 (exec, eval, os.system 等)"""
-
-        user_prompt = f"""目標網址: {url}
-抓取目標: {target_description}
-建議的 CSS Selectors: {selectors}
-資料結構: {data_structure}
-頁面類型: {page_type}
-
-請生成 Python 爬蟲程式碼。"""
+        temperature = 0.2
+        
+        # 檢查快取 (相同規格書)
+        use_cache = temperature <= MAX_CACHEABLE_TEMPERATURE
+        cache_key = make_cache_key({
+            "url": url,
+            "target": target_description,
+            "selectors": list(selectors),
+            "structure": data_structure,
+            "page_type": page_type
+        }, self._cache_version)
+        if use_cache:
+            cached = self._cache.get(cache_key)
+            if cached:
+                print("⚡ Generator 快取命中")
+                return GeneratedCode(**cached)
+        
+        # 相同請求同時進行時只呼叫一次 API (single-flight)
+        return await self._flight.do(
+            cache_key,
+            lambda: self._generate(
+                url, target_description, selectors, data_structure, page_type,
+                temperature, cache_key, use_cache
+            )
+        )
+    
+    async def _generate(
+        self,
+        url: str,
+        target_description: str,
+        selectors: list,
+        data_structure: dict,
+        page_type: str,
+        temperature: float,
+        cache_key: str,
+        use_cache: bool
+    ) -> GeneratedCode:
+        """快取未命中時的生成流程: 呼叫 API → 寫入快取"""
+        # 動態內容只放在 user prompt，結構以固定順序序列化，相同規格書會產生逐位元組相同的 prompt
+        # (selectors 保留 Analyzer 的重要性順序，主要容器在第一個；相同輸入的順序本來就相同)
+        user_prompt = _build_prompt(
+            url,
+            target_description,
+            tuple(selectors),
+            json.dumps(data_structure, ensure_ascii=False, sort_keys=True),
+            page_type
+        )
 
         # 呼叫 API (自動選擇)
         response = await self._client.chat(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": _GENERATE_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.2,
-            json_mode=True
+            temperature=temperature,
+            response_schema=GENERATED_CODE_SCHEMA
         )
         
-        # 解析回應 - 嘗試提取 JSON
-        content = response.content.strip()
-        
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            import re
-            # 嘗試從 markdown 代碼塊提取
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-            if json_match:
-                data = json.loads(json_match.group(1))
-            else:
-                # 嘗試提取程式碼
-                code_match = re.search(r'```python\s*(.*?)\s*```', content, re.DOTALL)
-                code = code_match.group(1) if code_match else content
-                data = {
-                    "code": code,
-                    "imports": [],
-                    "explanation": "從回應中提取"
-                }
-        
-        return GeneratedCode(
-            code=data.get("code", ""),
-            imports=data.get("imports", []),
-            explanation=data.get("explanation", ""),
+        # Structured Outputs 保證回應符合 GENERATED_CODE_SCHEMA
+        data = response.json()
+        result = GeneratedCode(
+            code=data["code"],
+            imports=data["imports"],
+            explanation=data["explanation"],
             usage=response.usage
         )
+        
+        if use_cache:
+            self._cache.set(cache_key, {**asdict(result), "usage": None})
+        
+        return result
     
     async def fix_code(self, original_code: str, url: str, goal: str, error: str, user_feedback: str = "") -> str:
         """
         修正爬蟲程式碼
         """
-        system_prompt = """你是一個 Python 爬蟲專家。使用者的爬蟲程式碼執行後返回空結果或錯誤。
-請分析問題並修正程式碼。
-
-規則：
-1. 保持 scrape(url) 函數結構
-2. 修正 CSS selector 或資料提取邏輯
-3. 只輸出修正後的完整程式碼，不要解釋
-4. 使用 requests + BeautifulSoup
-5. 優先參考使用者的額外指示（如果有的話）"""
-
         user_prompt = f"""目標網址: {url}
 使用者目標: {goal}
 
@@ -141,30 +391,27 @@ class ScraperGenerator:
 {error}
 
 使用者額外指示 (Feedback):
-{user_feedback if user_feedback else "無"}
-
-請求:
-請根據上述執行結果和指示修正程式碼。
-1. 若結果為 Null/空，請檢查 CSS Selector。
-2. 若有 Exception，請修復語法或邏輯。
-3. 確保符合沙箱安全限制 (僅用 requests, bs4, urllib, json)。"""
+{user_feedback if user_feedback else "無"}"""
 
         response = await self._client.chat(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": _FIX_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.2
         )
         
         # 提取程式碼
-        content = response.content.strip()
-        import re
-        code_match = re.search(r'```python\s*(.*?)\s*```', content, re.DOTALL)
-        return code_match.group(1) if code_match else content
+        return _extract_code(response.content.strip())
 
+    async def warmup(self) -> None:
+        """預先建立 API 連線 (可與網頁載入並行)"""
+        await self._client.warmup()
+    
     async def close(self):
-        await self._client.close()
+        if self._owns_client:
+            await self._client.close()
+        self._cache.close()
 
 
 # 測試
@@ -0,0 +1,85 @@
+"""
+JSON 工具
+從 LLM 串流回應中偵測完整的 JSON 物件
+"""
+import json
+from typing import Optional, Any
+
+# orjson 解析與序列化速度較快；未安裝時使用標準庫
+# (orjson.JSONDecodeError 是 json.JSONDecodeError 的子類別，例外處理不變)
+try:
+    from orjson import loads, dumps as _orjson_dumps
+except ImportError:
+    from json import loads
+    _orjson_dumps = None
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化為 UTF-8 JSON bytes，無法序列化的值轉為字串"""
+    if _orjson_dumps:
+        return _orjson_dumps(obj, default=str)
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+
+class JSONObjectScanner:
+    """
+    增量式 JSON 物件掃描器
+    
+    逐段餵入文字 (例如串流回應的 token)，追蹤大括號深度並略過字串內容
+    (含跳脫字元)，物件一完整就嘗試解析。單次線性掃描、支援巢狀物件，
+    不會有 regex 回溯的問題
+    """
+    
+    def __init__(self):
+        self._buffer = []
+        self._pos = 0          # 已掃描的字元數
+        self._depth = 0
+        self._start = -1       # 目前物件的起點
+        self.first_start = -1  # 第一個 "{" 的位置
+        self._in_string = False
+        self._escaped = False
+        self.result: Optional[dict] = None
+    
+    def feed(self, chunk: str) -> Optional[dict]:
+        """餵入一段文字，找到第一個可解析的 JSON 物件時回傳該物件"""
+        if self.result is not None:
+            return self.result
+        
+        self._buffer.append(chunk)
+        for ch in chunk:
+            i = self._pos
+            self._pos += 1
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            
+            if ch == '"':
+                # 只有在物件內的引號才算字串開頭
+                self._in_string = self._depth > 0
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = i
+                    if self.first_start < 0:
+                        self.first_start = i
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    text = "".join(self._buffer)
+                    self._buffer = [text]
+                    try:
+                        data = loads(text[self._start:i + 1])
+                        if isinstance(data, dict):
+                            self.result = data
+                            return data
+                    except json.JSONDecodeError:
+                        pass
+        
+        return None
+
@@ -2,13 +2,23 @@
 Azure OpenAI 客戶端 (使用 MAF)
 使用 Microsoft Agent Framework 的 AzureOpenAIResponsesClient
 """
-import os
 import asyncio
-from typing import Optional, List, Dict, Any
+import hashlib
+from typing import Optional, List, Dict, Any, Tuple
 from dataclasses import dataclass
-from dotenv import load_dotenv
+import httpx
 
-load_dotenv()
+from agents.config import settings
+from agents.json_util import loads, JSONObjectScanner
+
+# 429 / 5xx / 逾時 最多嘗試 3 次，指數退避 1s → 2s → ... (上限 30s)
+MAX_ATTEMPTS = 3
+RETRY_MIN_WAIT = 1.0
+RETRY_MAX_WAIT = 30.0
+
+
+class ModelResponseError(ValueError):
+    """模型拒絕回答或回傳的內容無法解析"""
 
 
 @dataclass
@@ -17,6 +27,23 @@ class ChatResponse:
     content: str
     usage: Optional[Dict] = None
     api_type: str = "maf"
+    refusal: Optional[str] = None
+    
+    def json(self) -> Any:
+        """
+        解析 JSON 內容
+        
+        模型拒絕回答、回傳空白或不完整的 JSON 時拋出 ModelResponseError，
+        而不是讓 JSON 解析錯誤一路往上拋
+        """
+        if self.refusal:
+            raise ModelResponseError(f"模型拒絕回答: {self.refusal}")
+        if not self.content or not self.content.strip():
+            raise ModelResponseError("模型回傳空白內容")
+        try:
+            return loads(self.content)
+        except ValueError as e:
+            raise ModelResponseError(f"模型回傳的 JSON 無法解析: {e}") from e
 
 
 class AzureOpenAIClient:
@@ -30,14 +57,15 @@ class AzureOpenAIClient:
         deployment: Optional[str] = None,
         prefer_responses: bool = True
     ):
-        self.endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "").rstrip("/")
-        self.api_key = os.getenv("AZURE_OPENAI_API_KEY")
-        self.deployment = deployment or os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-5.2-chat")
-        self.api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2025-04-01-preview")
+        self.endpoint = settings.endpoint
+        self.api_key = settings.api_key
+        self.deployment = deployment or settings.chat_deployment
+        self.api_version = settings.api_version
         self.prefer_responses = prefer_responses
         
-        self._agent = None
+        self._agent_cache: Dict[bytes, Any] = {}  # system prompt hash → MAF agent
         self._maf_available = None
+        self._http: Optional[httpx.AsyncClient] = None
     
     async def _init_maf(self):
         """初始化 MAF 客戶端"""
@@ -71,13 +99,23 @@ class AzureOpenAIClient:
         messages: List[Dict[str, Any]],
         temperature: float = 0.3,
         json_mode: bool = False,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        response_schema: Optional[Dict[str, Any]] = None
     ) -> ChatResponse:
-        """發送聊天請求"""
-        if self.prefer_responses and await self._init_maf():
+        """
+        發送聊天請求
+        
+        Args:
+            response_schema: Structured Outputs 的 json_schema 設定
+                ({"name": ..., "strict": True, "schema": {...}})，提供時隱含 json_mode
+        """
+        json_mode = json_mode or response_schema is not None
+        
+        # MAF agent 不支援 response_format，需要 JSON 輸出時一律走 Completions API
+        if self.prefer_responses and not json_mode and await self._init_maf():
             return await self._chat_maf(messages, temperature)
         else:
-            return await self._chat_completions(messages, temperature, json_mode, max_tokens)
+            return await self._chat_completions(messages, temperature, json_mode, max_tokens, response_schema)
     
     async def _chat_maf(
         self,
@@ -98,11 +136,15 @@ class AzureOpenAIClient:
                     content = " ".join(c.get("text", "") for c in content if c.get("type") == "text")
                 user_msg = content
         
-        # 建立 agent 並執行
-        agent = self._maf_client.create_agent(
-            name="SmartScraperAgent",
-            instructions=system_msg,
-        )
+        # 相同 system prompt 重用同一個 agent，不必每次重建
+        key = hashlib.blake2b(system_msg.encode(), digest_size=16).digest()
+        agent = self._agent_cache.get(key)
+        if agent is None:
+            agent = self._maf_client.create_agent(
+                name="SmartScraperAgent",
+                instructions=system_msg,
+            )
+            self._agent_cache[key] = agent
         
         response = await agent.run(user_msg)
         
@@ -127,44 +169,140 @@ class AzureOpenAIClient:
         messages: List[Dict[str, Any]],
         temperature: float,
         json_mode: bool,
-        max_tokens: Optional[int]
+        max_tokens: Optional[int],
+        response_schema: Optional[Dict[str, Any]] = None
     ) -> ChatResponse:
         """使用 Completions API (httpx)"""
-        import httpx
-        
         url = f"{self.endpoint}/openai/deployments/{self.deployment}/chat/completions?api-version={self.api_version}"
         
         payload = {
             "messages": messages,
             "temperature": temperature,
+            # 串流回應：邊收 token 邊解析，最後一個 chunk 附帶 usage
+            "stream": True,
+            "stream_options": {"include_usage": True},
         }
         
-        if json_mode:
+        if response_schema:
+            # 保證輸出符合 schema，不會缺欄位或夾雜其他文字
+            payload["response_format"] = {"type": "json_schema", "json_schema": response_schema}
+        elif json_mode:
             payload["response_format"] = {"type": "json_object"}
         
         if max_tokens:
             payload["max_tokens"] = max_tokens
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                url,
-                headers={"api-key": self.api_key},
-                json=payload
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-        
-        content = result["choices"][0]["message"]["content"]
+        client = self._get_http()
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                async with client.stream(
+                    "POST",
+                    url,
+                    headers={"api-key": self.api_key},
+                    json=payload
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    content, refusal, usage = await self._read_stream(response, json_mode)
+                break
+            except (httpx.HTTPStatusError, httpx.TimeoutException, asyncio.TimeoutError) as e:
+                # 只重試限流 (429) 與伺服器錯誤 (5xx)
+                reason = type(e).__name__
+                if isinstance(e, httpx.HTTPStatusError):
+                    status = e.response.status_code
+                    if status != 429 and status < 500:
+                        raise
+                    reason = f"HTTP {status}"
+                if attempt + 1 >= MAX_ATTEMPTS:
+                    raise
+                wait = min(RETRY_MAX_WAIT, RETRY_MIN_WAIT * 2 ** attempt)
+                print(f"⚠️ API 呼叫失敗 (嘗試 {attempt + 1}/{MAX_ATTEMPTS}): {reason}，{wait:.0f}s 後重試")
+                await asyncio.sleep(wait)
+    
+        # Prefix cache 命中率 (system prompt 超過 1024 tokens 才會被快取)
+        if usage and usage.get("prompt_tokens"):
+            cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            print(f"💾 Prompt cache: {cached_tokens}/{usage['prompt_tokens']} tokens "
+                  f"({cached_tokens / usage['prompt_tokens']:.0%})")
         
         return ChatResponse(
             content=content,
-            usage=result.get("usage"),
-            api_type="completions"
+            usage=usage,
+            api_type="completions",
+            refusal=refusal
         )
     
+    async def _read_stream(self, response, json_mode: bool) -> Tuple[str, Optional[str], Optional[Dict]]:
+        """
+        讀取 SSE 串流，累積 choices[0].delta.content (與拒絕回答時的 delta.refusal)
+        
+        json_mode 時一偵測到完整的 JSON 物件就停止累積與解析內容，
+        之後只繼續讀完串流 (保留連線可重用) 並取得最後的 usage
+        """
+        parts = []
+        refusal_parts = []
+        usage = None
+        scanner = JSONObjectScanner() if json_mode else None
+        done = False
+        
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            if done and '"usage"' not in data:
+                continue
+            
+            chunk = loads(data)
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            if done:
+                continue
+            
+            for choice in chunk.get("choices") or []:
+                refusal = (choice.get("delta") or {}).get("refusal")
+                if refusal:
+                    refusal_parts.append(refusal)
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    if scanner and scanner.feed(delta) is not None:
+                        done = True
+        
+        return "".join(parts), "".join(refusal_parts) or None, usage
+    
+    def _get_http(self) -> httpx.AsyncClient:
+        """
+        取得共用的 httpx 客戶端 (第一次使用時才建立，需在 event loop 內)
+        保持連線與 TLS session，HTTP/2 讓並行請求共用同一條連線
+        """
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                http2=True,
+                timeout=120.0,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+            )
+        return self._http
+    
+    async def warmup(self) -> None:
+        """
+        預先建立與 Azure OpenAI 的連線 (TCP + TLS + HTTP/2)
+        與其他 I/O 並行呼叫，之後的 chat 請求直接重用連線；失敗時忽略
+        """
+        if not self.endpoint:
+            return
+        try:
+            await self._get_http().head(self.endpoint, timeout=5.0)
+        except httpx.HTTPError:
+            pass
+    
     async def close(self):
-        pass  # MAF 不需要手動關閉
+        # MAF 不需要手動關閉，只需關閉共用的 httpx 客戶端
+        if self._http:
+            await self._http.aclose()
+            self._http = None
 
 
 # 測試
@@ -0,0 +1,139 @@
+"""
+單一網址流程
+/analyze、/generate、/full 共用：載入網頁 → 分析 → 生成程式碼 → 執行
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Optional, Literal, Callable, Awaitable, AsyncIterator, Tuple, Any
+
+from browser.playwright_client import PlaywrightClient, PageAnalysis
+from agents.analyzer import PageAnalyzer, AnalysisResult
+from agents.generator import ScraperGenerator, GeneratedCode
+from sandbox.executor import ExecutionResult
+
+# 執行到哪個階段為止
+Stage = Literal["analyze", "generate", "execute"]
+
+
+@dataclass
+class PipelineResult:
+    """流程結果，未執行的階段為 None"""
+    page_title: str
+    analysis: AnalysisResult
+    generated: Optional[GeneratedCode] = None
+    execution: Optional[ExecutionResult] = None
+
+
+async def _load_page_and_warmup(
+    browser_client: PlaywrightClient,
+    url: str,
+    take_screenshot: bool,
+    analyzer: PageAnalyzer,
+    generator: Optional[ScraperGenerator]
+) -> PageAnalysis:
+    """
+    載入網頁的同時預先建立 Analyzer / Generator 的 API 連線，
+    網頁載入完成時連線已就緒，省下分析前的連線往返
+    """
+    try:
+        async with asyncio.TaskGroup() as tg:
+            page_task = tg.create_task(browser_client.analyze_page(url, take_screenshot=take_screenshot))
+            tg.create_task(analyzer.warmup())
+            if generator:
+                tg.create_task(generator.warmup())
+    except* Exception as eg:
+        # warmup 不會拋出例外，只可能是網頁載入失敗，還原為原本的例外
+        raise eg.exceptions[0] from None
+    return page_task.result()
+
+
+def _print_analysis(analysis: AnalysisResult) -> None:
+    """[Debug] 顯示分析結果"""
+    print("\n" + "="*50)
+    print("🤖 Analyzer 思考結果 (傳給 Generator 的規格書):")
+    print("-" * 50)
+    print(f"📌 目標描述: {analysis.target_description}")
+    print(f"🔍 建議 Selectors: {analysis.suggested_selectors}")
+    print(f"📐 預期資料結構: {analysis.data_structure}")
+    print(f"📄 頁面類型: {analysis.page_type}")
+
+    if analysis.usage:
+        print(f"💰 Analyzer Usage: {analysis.usage}")
+    print("="*50 + "\n")
+
+
+async def iter_pipeline(
+    url: str,
+    goal: str,
+    *,
+    browser_client: PlaywrightClient,
+    analyzer: PageAnalyzer,
+    generator: Optional[ScraperGenerator] = None,
+    execute: Optional[Callable[[str, str], Awaitable[ExecutionResult]]] = None,
+    use_vision: bool = True,
+    stop_after: Stage = "execute"
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    執行單一網址的流程，每完成一個步驟就產出 (步驟名稱, 結果)
+
+    步驟依序為 "page" (PageAnalysis)、"analysis" (AnalysisResult)、
+    "generation" (GeneratedCode)、"execution" (ExecutionResult)
+
+    Args:
+        url: 目標網址
+        goal: 使用者目標
+        browser_client / analyzer / generator: 共用的客戶端 (由呼叫端管理生命週期)
+        execute: 執行產生的程式碼 (code, url) → ExecutionResult，stop_after="execute" 時需要
+        use_vision: 是否截圖並交給 Analyzer
+        stop_after: 執行到哪個階段為止
+    """
+    needs_generator = stop_after != "analyze"
+
+    # Step 1: 載入網頁 (不使用 Vision 時不截圖)，同時預先建立 API 連線
+    page_data = await _load_page_and_warmup(
+        browser_client, url, use_vision, analyzer, generator if needs_generator else None
+    )
+    yield "page", page_data
+
+    # Step 2: 分析
+    analysis = await analyzer.analyze(
+        user_goal=goal,
+        page_title=page_data.title,
+        simplified_html=page_data.simplified_html,
+        screenshot_base64=page_data.screenshot_base64 if use_vision else None,
+        url=url
+    )
+    yield "analysis", analysis
+    if not needs_generator:
+        return
+
+    _print_analysis(analysis)
+
+    # Step 3: 生成程式碼
+    generated = await generator.generate(
+        url=url,
+        target_description=analysis.target_description,
+        selectors=analysis.suggested_selectors,
+        data_structure=analysis.data_structure,
+        page_type=analysis.page_type
+    )
+    if generated.usage:
+        print(f"💰 Generator Usage: {generated.usage}")
+    yield "generation", generated
+
+    # Step 4: 執行
+    if stop_after == "execute":
+        yield "execution", await execute(generated.code, url)
+
+
+async def run_pipeline(url: str, goal: str, **kwargs) -> PipelineResult:
+    """執行單一網址的流程並彙整結果 (參數同 iter_pipeline)"""
+    steps = {}
+    async for step, value in iter_pipeline(url, goal, **kwargs):
+        steps[step] = value
+    return PipelineResult(
+        page_title=steps["page"].title,
+        analysis=steps["analysis"],
+        generated=steps.get("generation"),
+        execution=steps.get("execution")
+    )
@@ -0,0 +1,70 @@
+"""
+Prompt 壓縮
+送給 LLM 之前縮減簡化 DOM 的 token 數：
+合併連續空白，並摺疊重複出現的相同結構 (列表項目、表格列等)
+"""
+import re
+from typing import List, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+# 相同結構的兄弟節點最多保留幾個，其餘以一行摘要取代
+# (分析只需要看出重複的模式，不需要每一筆資料)
+MAX_REPEATED_SIBLINGS = 3
+
+
+def _parse(simplified_html: str) -> List[Tuple[int, str, str]]:
+    """拆成 (縮排深度, 標籤, 內容) 清單，內容中的連續空白合併為一個空格"""
+    nodes = []
+    for line in simplified_html.split("\n"):
+        content = line.lstrip(" ")
+        if not content:
+            continue
+        depth = len(line) - len(content)
+        content = _WHITESPACE.sub(" ", content).rstrip()
+        tag = content.split(" ", 1)[0]
+        nodes.append((depth, tag, content))
+    return nodes
+
+
+def _fold(nodes: List[Tuple[int, str, str]], start: int, end: int, max_repeats: int, out: List[str]) -> None:
+    """輸出 nodes[start:end] 的兄弟節點，同一結構超過 max_repeats 個時摺疊"""
+    seen = {}      # 結構 → 已出現次數
+    skipped = {}   # 結構 → (略過數量, 縮排, 標籤)
+    i = start
+    while i < end:
+        depth, tag, content = nodes[i]
+        j = i + 1
+        while j < end and nodes[j][0] > depth:
+            j += 1
+
+        # 結構 = 子樹中每個節點的相對深度與標籤 (不含文字)
+        shape = tuple((d - depth, t) for d, t, _ in nodes[i:j])
+        seen[shape] = seen.get(shape, 0) + 1
+        if seen[shape] <= max_repeats:
+            out.append(" " * depth + content)
+            _fold(nodes, i + 1, j, max_repeats, out)
+        else:
+            count = skipped.get(shape, (0,))[0]
+            skipped[shape] = (count + 1, depth, tag)
+        i = j
+
+    for count, depth, tag in skipped.values():
+        out.append(" " * depth + f"… 另有 {count} 個相同結構的 {tag}")
+
+
+def compress_html(simplified_html: str, max_repeats: int = MAX_REPEATED_SIBLINGS) -> str:
+    """
+    壓縮簡化後的 DOM (每行一個元素，縮排代表層級)
+
+    Args:
+        simplified_html: PlaywrightClient 產生的簡化 HTML
+        max_repeats: 相同結構的兄弟節點最多保留幾個
+
+    Returns:
+        壓縮後的簡化 HTML
+    """
+    nodes = _parse(simplified_html)
+    out: List[str] = []
+    _fold(nodes, 0, len(nodes), max_repeats, out)
+    return "\n".join(out)
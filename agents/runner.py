@@ -0,0 +1,188 @@
+"""
+多網址執行器
+同時處理多個網址：載入網頁 → 分析 → 生成程式碼 三段管線，
+每段由各自的 worker 以 asyncio.Queue 串接，前一頁等待 LLM 時下一頁已在載入
+"""
+import json
+import asyncio
+import argparse
+from typing import Optional, List, Tuple
+from dataclasses import dataclass, asdict
+
+from browser.playwright_client import PlaywrightClient, PageAnalysis
+from agents.config import settings
+from agents.openai_client import AzureOpenAIClient
+from agents.analyzer import PageAnalyzer, AnalysisResult
+from agents.generator import ScraperGenerator, GeneratedCode
+
+# 各階段的 worker 數 (瀏覽器分頁較吃資源，LLM 呼叫主要是等待)
+LOAD_WORKERS = 4
+ANALYZE_WORKERS = 8
+GENERATE_WORKERS = 8
+
+# 分析 worker 一次最多帶走幾個已載入的頁面做批次分析
+ANALYZE_BATCH_SIZE = 8
+
+
+@dataclass
+class RunResult:
+    """單一網址的執行結果"""
+    url: str
+    analysis: Optional[AnalysisResult] = None
+    generated: Optional[GeneratedCode] = None
+    error: Optional[str] = None
+
+
+async def run_many(
+    urls: List[str],
+    user_goal: str,
+    load_workers: int = LOAD_WORKERS,
+    analyze_workers: int = ANALYZE_WORKERS,
+    generate_workers: int = GENERATE_WORKERS,
+    browser_client: Optional[PlaywrightClient] = None,
+    analyzer: Optional[PageAnalyzer] = None,
+    generator: Optional[ScraperGenerator] = None
+) -> List[RunResult]:
+    """
+    對多個網址執行 載入 → 分析 → 生成 管線
+    
+    Args:
+        urls: 目標網址清單
+        user_goal: 使用者想要抓取什麼 (所有網址共用)
+        load_workers / analyze_workers / generate_workers: 各階段並行的 worker 數
+        browser_client / analyzer / generator: 共用的客戶端，未提供時自行建立並關閉
+    
+    Returns:
+        與 urls 順序相同的 RunResult 清單
+    """
+    own_browser = browser_client is None
+    own_analyzer = analyzer is None
+    own_generator = generator is None
+    browser_client = browser_client or PlaywrightClient()
+    
+    # 分析與生成使用同一個 deployment 時共用 OpenAI 客戶端 (連線與 MAF 初始化只做一次)
+    shared_client = None
+    if own_analyzer and own_generator and settings.chat_deployment == settings.codex_deployment:
+        shared_client = AzureOpenAIClient(deployment=settings.chat_deployment)
+    analyzer = analyzer or PageAnalyzer(client=shared_client)
+    generator = generator or ScraperGenerator(client=shared_client)
+    
+    results = [RunResult(url=url) for url in urls]
+    url_q: asyncio.Queue = asyncio.Queue()
+    analyze_q: asyncio.Queue = asyncio.Queue()   # (RunResult, PageAnalysis)，None 表示結束
+    generate_q: asyncio.Queue = asyncio.Queue()  # RunResult，None 表示結束
+    for result in results:
+        url_q.put_nowait(result)
+    
+    # Step 1: 載入網頁 (批次分析只用 HTML，不需要截圖)
+    async def load_worker() -> None:
+        while not url_q.empty():
+            result = url_q.get_nowait()
+            try:
+                page = await browser_client.analyze_page(result.url, take_screenshot=False)
+            except Exception as e:
+                result.error = str(e)
+                continue
+            await analyze_q.put((result, page))
+    
+    # Step 2: 分析，順便帶走佇列中已就緒的頁面一起批次送出
+    async def analyze_worker() -> None:
+        done = False
+        while not done:
+            item = await analyze_q.get()
+            if item is None:
+                return
+            batch: List[Tuple[RunResult, PageAnalysis]] = [item]
+            while len(batch) < ANALYZE_BATCH_SIZE and not analyze_q.empty():
+                item = analyze_q.get_nowait()
+                if item is None:
+                    done = True  # 處理完這批就結束
+                    break
+                batch.append(item)
+            
+            try:
+                if len(batch) == 1:
+                    _, page = batch[0]
+                    analyses = [await analyzer.analyze(user_goal, page.title, page.simplified_html, url=page.url)]
+                else:
+                    analyses = await analyzer.analyze_batch([
+                        (user_goal, page.title, page.simplified_html) for _, page in batch
+                    ])
+            except Exception as e:
+                for result, _ in batch:
+                    result.error = str(e)
+                continue
+            
+            for (result, _), analysis in zip(batch, analyses):
+                result.analysis = analysis
+                await generate_q.put(result)
+    
+    # Step 3: 生成程式碼
+    async def generate_worker() -> None:
+        while True:
+            result = await generate_q.get()
+            if result is None:
+                return
+            try:
+                result.generated = await generator.generate(
+                    url=result.url,
+                    target_description=result.analysis.target_description,
+                    selectors=result.analysis.suggested_selectors,
+                    data_structure=result.analysis.data_structure,
+                    page_type=result.analysis.page_type
+                )
+            except Exception as e:
+                result.error = str(e)
+    
+    try:
+        if own_browser:
+            await browser_client.start()
+        
+        # 三段同時啟動，上游結束後依序送出結束訊號 (每個 worker 一個 None)
+        loaders = [asyncio.create_task(load_worker()) for _ in range(load_workers)]
+        analyzers = [asyncio.create_task(analyze_worker()) for _ in range(analyze_workers)]
+        generators = [asyncio.create_task(generate_worker()) for _ in range(generate_workers)]
+        
+        await asyncio.gather(*loaders)
+        for _ in analyzers:
+            analyze_q.put_nowait(None)
+        await asyncio.gather(*analyzers)
+        for _ in generators:
+            generate_q.put_nowait(None)
+        await asyncio.gather(*generators)
+        
+    finally:
+        if own_generator:
+            await generator.close()
+        if own_analyzer:
+            await analyzer.close()
+        if shared_client:
+            await shared_client.close()
+        if own_browser:
+            await browser_client.stop()
+    
+    return results
+
+
+# 命令列: python -m agents.runner "抓取文章標題" https://a.com https://b.com
+async def main():
+    parser = argparse.ArgumentParser(description="對多個網址產生爬蟲程式碼")
+    parser.add_argument("goal", help="要抓取什麼")
+    parser.add_argument("urls", nargs="+", help="目標網址")
+    parser.add_argument("--load-workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument("--analyze-workers", type=int, default=ANALYZE_WORKERS)
+    parser.add_argument("--generate-workers", type=int, default=GENERATE_WORKERS)
+    args = parser.parse_args()
+    
+    results = await run_many(
+        args.urls,
+        args.goal,
+        load_workers=args.load_workers,
+        analyze_workers=args.analyze_workers,
+        generate_workers=args.generate_workers
+    )
+    print(json.dumps([asdict(r) for r in results], ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
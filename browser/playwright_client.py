@@ -3,12 +3,48 @@ Playwright 瀏覽器客戶端
 負責載入網頁、截圖、提取 HTML
 """
 import asyncio
-from playwright.async_api import async_playwright, Page, Browser
+from playwright.async_api import async_playwright, Page, Browser, BrowserContext, Route
+from lxml import html as lxml_html, etree
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Set, Tuple
 import base64
 
 
+# 無頭 Chromium 啟動參數 (不用 GPU、容器中 /dev/shm 太小時改用 /tmp)
+_LAUNCH_ARGS = ["--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"]
+
+# 不影響 HTML 結構的資源一律不載入；圖片與樣式只有截圖時需要
+_BLOCKED_RESOURCES = frozenset({"font", "media"})
+_VISUAL_RESOURCES = frozenset({"image", "stylesheet"})
+
+# 廣告與追蹤服務
+_TRACKER_HOSTS = (
+    "doubleclick.net",
+    "googlesyndication.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "facebook.net",
+    "hotjar.com",
+)
+
+# 沒有文字也要保留的結構標籤
+_KEEP_TAGS = frozenset({"table", "tr", "td", "th", "ul", "ol", "li", "a", "img"})
+
+
+async def _block_resources(route: Route, take_screenshot: bool) -> None:
+    """中止不需要的子資源請求，縮短載入時間與記憶體用量"""
+    request = route.request
+    kind = request.resource_type
+    if (
+        kind in _BLOCKED_RESOURCES
+        or (not take_screenshot and kind in _VISUAL_RESOURCES)
+        or any(host in request.url for host in _TRACKER_HOSTS)
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
 @dataclass
 class PageAnalysis:
     """網頁分析結果"""
@@ -22,29 +58,50 @@ class PageAnalysis:
 class PlaywrightClient:
     """Playwright 瀏覽器封裝"""
     
-    def __init__(self):
+    def __init__(self, max_pool: int = 4):
         self._browser: Optional[Browser] = None
         self._playwright = None
+        
+        # 預先建立的全新 context (各附一個分頁)
+        # 每個請求獨佔一個 context，用完即關閉，cookie / storage 不會帶到下一個請求；
+        # 關閉後在背景補上新的，請求路徑上不必等待建立
+        self._max_pool = max_pool
+        self._context_pool: asyncio.Queue = asyncio.Queue(maxsize=max_pool)
+        self._refills: Set[asyncio.Task] = set()
     
     async def start(self) -> None:
-        """啟動瀏覽器"""
+        """啟動瀏覽器並預先建立 context"""
         self._playwright = await async_playwright().start()
-        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._browser = await self._playwright.chromium.launch(headless=True, args=_LAUNCH_ARGS)
+        for pair in await asyncio.gather(*(self._new_context() for _ in range(self._max_pool))):
+            self._context_pool.put_nowait(pair)
     
     async def stop(self) -> None:
         """關閉瀏覽器"""
+        for task in self._refills:
+            task.cancel()
+        await asyncio.gather(*self._refills, return_exceptions=True)
+        while not self._context_pool.empty():
+            context, _ = self._context_pool.get_nowait()
+            await context.close()
         if self._browser:
             await self._browser.close()
         if self._playwright:
             await self._playwright.stop()
     
-    async def analyze_page(self, url: str, max_retries: int = 2) -> PageAnalysis:
+    async def analyze_page(
+        self,
+        url: str,
+        max_retries: int = 2,
+        take_screenshot: bool = True
+    ) -> PageAnalysis:
         """
         分析網頁：載入、截圖、提取 HTML
         
         Args:
             url: 目標網址
             max_retries: 最大重試次數
+            take_screenshot: 是否截圖 (只有 Vision 分析需要，不需要時回傳空字串)
             
         Returns:
             PageAnalysis 包含截圖和 HTML
@@ -55,27 +112,27 @@ class PlaywrightClient:
         last_error = None
         
         for attempt in range(max_retries + 1):
-            page = await self._browser.new_page()
+            context, page = await self._acquire_context()
             
             try:
+                await context.route("**/*", lambda route: _block_resources(route, take_screenshot))
+                
                 # 載入網頁 (使用 domcontentloaded 加快速度)
                 await page.goto(url, wait_until="domcontentloaded", timeout=60000)
                 
                 # 等待頁面穩定
                 await page.wait_for_timeout(3000)
                 
-                # 取得基本資訊
-                title = await page.title()
-                
-                # 截圖 (for GPT Vision)
-                screenshot_bytes = await page.screenshot(full_page=False)
-                screenshot_base64 = base64.b64encode(screenshot_bytes).decode()
-                
-                # 取得完整 HTML
-                html = await page.content()
+                # 標題、完整 HTML 與截圖 (for GPT Vision，JPEG 比 PNG 小約 5 倍) 同時取得，
+                # 瀏覽器編碼截圖時可以一併序列化 DOM
+                steps = [page.title(), page.content()]
+                if take_screenshot:
+                    steps.append(page.screenshot(type="jpeg", quality=60, full_page=False))
+                title, html, *screenshot = await asyncio.gather(*steps)
+                screenshot_base64 = base64.b64encode(screenshot[0]).decode() if screenshot else ""
                 
                 # 簡化 HTML (移除 script, style, 保留結構)
-                simplified = await self._simplify_html(page)
+                simplified = await asyncio.to_thread(self._simplify_html, html)
                 
                 return PageAnalysis(
                     url=url,
@@ -90,57 +147,88 @@ class PlaywrightClient:
                 print(f"⚠️ 載入失敗 (嘗試 {attempt + 1}/{max_retries + 1}): {e}")
                 
             finally:
-                await page.close()
+                await self._release_context(context)
         
         # 所有重試都失敗
         raise Exception(f"無法載入網頁 {url}: {last_error}")
     
-    async def _simplify_html(self, page: Page) -> str:
+    async def _new_context(self) -> Tuple[BrowserContext, Page]:
+        """建立全新的 context 與分頁"""
+        context = await self._browser.new_context(
+            viewport={"width": 1280, "height": 800},
+            java_script_enabled=True,
+            bypass_csp=True
+        )
+        return context, await context.new_page()
+    
+    async def _acquire_context(self) -> Tuple[BrowserContext, Page]:
+        """取出預先建立的 context，池中沒有時當場建立"""
+        try:
+            return self._context_pool.get_nowait()
+        except asyncio.QueueEmpty:
+            return await self._new_context()
+    
+    async def _release_context(self, context: BrowserContext) -> None:
+        """關閉用過的 context，並在背景補一個新的到池中"""
+        await context.close()
+        if not self._context_pool.full():
+            task = asyncio.create_task(self._refill())
+            self._refills.add(task)
+            task.add_done_callback(self._refills.discard)
+    
+    async def _refill(self) -> None:
+        try:
+            pair = await self._new_context()
+        except Exception as e:
+            print(f"⚠️ 預先建立 context 失敗: {e}")
+            return
+        try:
+            self._context_pool.put_nowait(pair)
+        except asyncio.QueueFull:
+            await pair[0].close()
+    
+    def _simplify_html(self, html: str) -> str:
         """
         簡化 HTML：移除 script/style，只保留結構
+        直接解析已取得的 HTML，不必再回到瀏覽器執行 JS
         """
-        simplified = await page.evaluate("""
-            () => {
-                const clone = document.body.cloneNode(true);
-                
-                // 移除不需要的元素
-                const removeSelectors = ['script', 'style', 'noscript', 'svg', 'iframe'];
-                removeSelectors.forEach(sel => {
-                    clone.querySelectorAll(sel).forEach(el => el.remove());
-                });
-                
-                // 簡化 - 只保留前 50 個有意義的元素
-                const meaningful = [];
-                const walk = (el, depth = 0) => {
-                    if (meaningful.length >= 300) return;
-                    if (depth > 8) return;
-                    
-                    const tag = el.tagName?.toLowerCase();
-                    if (!tag) return;
-                    
-                    // 有文字或特定標籤才保留
-                    const text = el.textContent?.trim().slice(0, 100);
-                    if (text || ['table', 'tr', 'td', 'th', 'ul', 'ol', 'li', 'a', 'img'].includes(tag)) {
-                        const id = el.id ? `#${el.id}` : '';
-                        const cls = el.className ? `.${el.className.split(' ')[0]}` : '';
-                        meaningful.push({
-                            tag: tag + id + cls,
-                            text: text?.slice(0, 50) || '',
-                            depth
-                        });
-                    }
-                    
-                    for (const child of el.children) {
-                        walk(child, depth + 1);
-                    }
-                };
-                
-                walk(clone);
-                return meaningful.map(m => '  '.repeat(m.depth) + `<${m.tag}> ${m.text}`).join('\\n');
-            }
-        """)
+        if not html.strip():
+            return ""
+        
+        tree = lxml_html.fromstring(html)
+        body = tree.find(".//body")
+        if body is None:
+            body = tree
+        
+        # 移除不需要的元素 (保留其後的文字)
+        etree.strip_elements(body, "script", "style", "noscript", "svg", "iframe", with_tail=False)
+        
+        # 簡化 - 只保留前 300 個有意義的元素，最深 8 層
+        lines = []
+        stack = [(body, 0)]
+        while stack and len(lines) < 300:
+            el, depth = stack.pop()
+            if depth > 8:
+                continue
+            
+            tag = el.tag  # lxml 的 HTML parser 已轉成小寫
+            
+            # 有文字或特定標籤才保留
+            # 合併空白與換行，避免文字中的換行打亂「一行一個元素」的格式
+            text = " ".join(el.text_content().split())[:100]
+            if text or tag in _KEEP_TAGS:
+                el_id = el.get("id")
+                el_cls = el.get("class")
+                tag_id = f"#{el_id}" if el_id else ""
+                tag_cls = f".{el_cls.split(' ')[0]}" if el_cls else ""
+                lines.append(f"{'  ' * depth}<{tag}{tag_id}{tag_cls}> {text[:50]}")
+            
+            # 反向推入，維持文件順序 (註解等非元素節點略過)
+            for child in reversed(el):
+                if isinstance(child.tag, str):
+                    stack.append((child, depth + 1))
         
-        return simplified
+        return "\n".join(lines)
 
 
 # 測試用
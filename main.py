@@ -2,29 +2,52 @@
 SmartScraper - AI 驅動的爬蟲生成器
 FastAPI 主入口
 """
-import os
+import asyncio
 from contextlib import asynccontextmanager
-from typing import Optional, List, Dict, Any
+from functools import partial
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator, Callable, Tuple
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.routing import APIRoute
 from pydantic import BaseModel
-from dotenv import load_dotenv
+import anyio
 import io
+import re
 import zipfile
+from urllib.parse import urlparse
 
 from browser.playwright_client import PlaywrightClient
-from agents.analyzer import PageAnalyzer
-from agents.generator import ScraperGenerator
-from sandbox.executor import SandboxExecutor
-
-load_dotenv()
+from agents.config import settings
+from agents.openai_client import AzureOpenAIClient, ModelResponseError
+from agents.analyzer import PageAnalyzer, AnalysisResult
+from agents.generator import ScraperGenerator, GeneratedCode
+from agents.pipeline import run_pipeline, iter_pipeline, PipelineResult
+from agents.json_util import loads, dumps
+from sandbox.executor import SandboxExecutor, ExecutionResult
 
 # 全域客戶端
 browser_client: Optional[PlaywrightClient] = None
 
+# 網域轉為檔名時要替換的字元
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^a-zA-Z0-9]')
+
+# ZIP 中超過此大小的檔案才壓縮 (小型文字檔壓縮只是浪費 CPU)
+ZIP_DEFLATE_MIN_SIZE = 1024
+
+# 回應超過此大小才以 gzip 壓縮 (程式碼、分析結果等文字壓縮率高)；
+# 等級 5 的壓縮率接近最高等級，CPU 成本低很多
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+# 不壓縮的路徑：/download 回傳的 ZIP 已經壓縮過，再 gzip 一次只是浪費 CPU
+GZIP_EXCLUDED_PATHS = frozenset({"/download"})
+
+# 同時執行的沙箱 process 上限
+SANDBOX_WORKERS = 4
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -33,17 +56,75 @@ async def lifespan(app: FastAPI):
     browser_client = PlaywrightClient()
     await browser_client.start()
     print("✅ Playwright 瀏覽器已啟動")
+    
+    # OpenAI 客戶端依 deployment 共用 (連線池與 TLS session 在請求間保持)，
+    # Agent 同樣在所有請求間共用 (快取只開啟一次)
+    app.state.openai_clients = {
+        deployment: AzureOpenAIClient(deployment=deployment)
+        for deployment in {settings.chat_deployment, settings.codex_deployment}
+    }
+    app.state.analyzer = PageAnalyzer(client=app.state.openai_clients[settings.chat_deployment])
+    app.state.generator = ScraperGenerator(client=app.state.openai_clients[settings.codex_deployment])
+    
+    # 預先啟動待命的沙箱子 process，第一次執行不必等待啟動
+    app.state.executor = SandboxExecutor()
+    await asyncio.to_thread(app.state.executor.start)
+    app.state.sandbox_slots = asyncio.Semaphore(SANDBOX_WORKERS)
+    
+    # 提高 anyio 執行緒上限 (預設 40)，避免同步工作排隊
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
     yield
+    app.state.executor.close()
+    await app.state.generator.close()
+    await app.state.analyzer.close()
+    for client in app.state.openai_clients.values():
+        await client.close()
     await browser_client.stop()
     print("🛑 瀏覽器已關閉")
 
 
+class _ORJSONRequest(Request):
+    """以 orjson 解析 request body (比標準庫 json 快，解析錯誤同樣是 JSONDecodeError)"""
+    
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class _ORJSONRoute(APIRoute):
+    """所有 endpoint 改用 _ORJSONRequest 解析 JSON body，驗證仍由 Pydantic 負責"""
+    
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        
+        async def route_handler(request: Request):
+            return await handler(_ORJSONRequest(request.scope, request.receive))
+        
+        return route_handler
+
+
+class _GZipMiddleware(GZipMiddleware):
+    """
+    略過 GZIP_EXCLUDED_PATHS 的 GZipMiddleware
+    (舊版 Starlette 只排除 text/event-stream，不會自動略過 application/zip)
+    """
+    
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["path"] in GZIP_EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
 app = FastAPI(
     title="SmartScraper",
     description="AI 驅動的爬蟲生成器 - 輸入 URL + 目標，自動產生爬蟲程式碼",
     version="1.1.0",
     lifespan=lifespan
 )
+app.router.route_class = _ORJSONRoute
+app.add_middleware(_GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
 
 # 靜態檔案
 static_path = Path(__file__).parent / "static"
@@ -51,6 +132,13 @@ if static_path.exists():
     app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
 
+@app.exception_handler(ModelResponseError)
+async def model_response_error(request: Request, e: ModelResponseError):
+    """模型拒絕回答或回傳空白內容：回傳明確的錯誤訊息，而不是 500 與 JSON 解析錯誤"""
+    print(f"❌ Model Error: {e}")
+    return JSONResponse(status_code=502, content={"detail": str(e)})
+
+
 @app.get("/", response_class=HTMLResponse)
 async def index():
     """首頁 - 網頁介面"""
@@ -106,117 +194,107 @@ async def health():
     return {"status": "ok", "browser": browser_client is not None}
 
 
+async def _run_sandbox(app: FastAPI, code: str, url: str) -> ExecutionResult:
+    """
+    執行沙箱程式碼
+    程式碼在子 process 執行 (逾時強制終止)，這裡只在執行緒中等待結果，不會卡住 event loop
+    """
+    async with app.state.sandbox_slots:
+        return await asyncio.to_thread(app.state.executor.execute, code, url)
+
+
+def _pipeline_clients(http_request: Request) -> Dict[str, Any]:
+    """流程共用的瀏覽器、Agent 與沙箱"""
+    if not browser_client:
+        raise HTTPException(500, "瀏覽器未啟動")
+
+    app = http_request.app
+    return {
+        "browser_client": browser_client,
+        "analyzer": app.state.analyzer,
+        "generator": app.state.generator,
+        "execute": partial(_run_sandbox, app)
+    }
+
+
+async def _pipeline(http_request: Request, url: str, goal: str, **kwargs) -> PipelineResult:
+    """以共用的瀏覽器與 Agent 執行單一網址流程"""
+    return await run_pipeline(url, goal, **_pipeline_clients(http_request), **kwargs)
+
+
+def _analysis_dict(analysis: AnalysisResult) -> Dict[str, Any]:
+    return {
+        "target": analysis.target_description,
+        "selectors": analysis.suggested_selectors,
+        "structure": analysis.data_structure
+    }
+
+
+def _generation_dict(generated: GeneratedCode) -> Dict[str, Any]:
+    return {
+        "code": generated.code,
+        "explanation": generated.explanation
+    }
+
+
+def _execution_dict(execution: ExecutionResult) -> Dict[str, Any]:
+    return {
+        "success": execution.success,
+        "data": execution.data if execution.success else None,
+        "error": execution.error if not execution.success else None
+    }
+
+
+# /full/stream 每個步驟輸出的內容 (與 /full 的 steps 相同)
+_STEP_VIEWS: Dict[str, Callable[[Any], Dict[str, Any]]] = {
+    "page": lambda page: {"page_title": page.title},
+    "analysis": _analysis_dict,
+    "generation": _generation_dict,
+    "execution": _execution_dict
+}
+
+
 @app.post("/analyze")
-async def analyze_page(request: AnalyzeRequest):
+async def analyze_page(request: AnalyzeRequest, http_request: Request):
     """
     分析網頁結構
     
     返回：建議的 selectors 和資料結構
     """
-    if not browser_client:
-        raise HTTPException(500, "瀏覽器未啟動")
-    
-    # 載入並分析網頁
-    page_data = await browser_client.analyze_page(request.url)
-    
-    # AI 分析
-    analyzer = PageAnalyzer()
-    try:
-        result = await analyzer.analyze(
-            user_goal=request.goal,
-            page_title=page_data.title,
-            simplified_html=page_data.simplified_html,
-            screenshot_base64=page_data.screenshot_base64
-        )
-        
-        return {
-            "page_title": page_data.title,
-            "analysis": {
-                "target": result.target_description,
-                "selectors": result.suggested_selectors,
-                "structure": result.data_structure,
-                "page_type": result.page_type
-            }
-        }
-    finally:
-        await analyzer.close()
+    result = await _pipeline(http_request, request.url, request.goal, stop_after="analyze")
+    return {
+        "page_title": result.page_title,
+        "analysis": {**_analysis_dict(result.analysis), "page_type": result.analysis.page_type}
+    }
 
 
 @app.post("/generate")
-async def generate_scraper(request: GenerateRequest):
+async def generate_scraper(request: GenerateRequest, http_request: Request):
     """
     生成爬蟲程式碼
     
     完整流程：分析 → 生成程式碼
     """
-    if not browser_client:
-        raise HTTPException(500, "瀏覽器未啟動")
-    
-    # Step 1: 載入網頁
-    page_data = await browser_client.analyze_page(request.url)
-    
-    # Step 2: 分析
-    analyzer = PageAnalyzer()
-    try:
-        analysis = await analyzer.analyze(
-            user_goal=request.goal,
-            page_title=page_data.title,
-            simplified_html=page_data.simplified_html,
-            screenshot_base64=page_data.screenshot_base64 if request.use_vision else None
-        )
-    finally:
-        await analyzer.close()
-    
-    # [Debug] 顯示分析結果
-    print("\n" + "="*50)
-    print("🤖 Analyzer 思考結果 (傳給 Generator 的規格書):")
-    print("-" * 50)
-    print(f"📌 目標描述: {analysis.target_description}")
-    print(f"🔍 建議 Selectors: {analysis.suggested_selectors}")
-    print(f"📐 預期資料結構: {analysis.data_structure}")
-    print(f"📄 頁面類型: {analysis.page_type}")
-
-    if analysis.usage:
-        print(f"💰 Analyzer Usage: {analysis.usage}")
-    print("="*50 + "\n")
-    
-    # Step 3: 生成程式碼
-    generator = ScraperGenerator()
-    try:
-        code_result = await generator.generate(
-            url=request.url,
-            target_description=analysis.target_description,
-            selectors=analysis.suggested_selectors,
-            data_structure=analysis.data_structure,
-            page_type=analysis.page_type
-        )
-        
-        if code_result.usage:
-            print(f"💰 Generator Usage: {code_result.usage}")
-        
-        return {
-            "analysis": {
-                "target": analysis.target_description,
-                "selectors": analysis.suggested_selectors,
-                "structure": analysis.data_structure
-            },
-            "generated_code": code_result.code,
-            "imports": code_result.imports,
-            "explanation": code_result.explanation
-        }
-    finally:
-        await generator.close()
+    result = await _pipeline(
+        http_request, request.url, request.goal,
+        use_vision=request.use_vision, stop_after="generate"
+    )
+    return {
+        "analysis": _analysis_dict(result.analysis),
+        "generated_code": result.generated.code,
+        "imports": result.generated.imports,
+        "explanation": result.generated.explanation
+    }
 
 
 @app.post("/execute")
-async def execute_code(request: ExecuteRequest):
+async def execute_code(request: ExecuteRequest, http_request: Request):
     """
     在沙箱中執行程式碼
     
     ⚠️ 只執行受信任的程式碼
     """
-    executor = SandboxExecutor()
-    result = executor.execute(request.code, request.url)
+    result = await _run_sandbox(http_request.app, request.code, request.url)
     
     if result.success:
         return {
@@ -236,126 +314,135 @@ async def execute_code(request: ExecuteRequest):
 
 
 @app.post("/fix")
-async def fix_code(request: FixRequest):
+async def fix_code(request: FixRequest, http_request: Request):
     """
     AI 修正程式碼
 
     根據執行結果修正爬蟲程式碼
     """
-    generator = ScraperGenerator()
-    try:
-        fixed_code = await generator.fix_code(
-            original_code=request.original_code,
-            url=request.url,
-            goal=request.goal,
-            error=request.execution_result,
-            user_feedback=request.user_feedback
-        )
-        return {"fixed_code": fixed_code}
-    finally:
-        await generator.close()
+    generator: ScraperGenerator = http_request.app.state.generator
+    fixed_code = await generator.fix_code(
+        original_code=request.original_code,
+        url=request.url,
+        goal=request.goal,
+        error=request.execution_result,
+        user_feedback=request.user_feedback
+    )
+    return {"fixed_code": fixed_code}
 
 
 @app.post("/full")
-async def full_pipeline(request: FullPipelineRequest):
+async def full_pipeline(request: FullPipelineRequest, http_request: Request):
     """
     完整流程：分析 → 生成 → 執行
     
     一鍵完成爬蟲任務
     """
-    if not browser_client:
-        raise HTTPException(500, "瀏覽器未啟動")
+    result = await _pipeline(
+        http_request, request.url, request.goal,
+        use_vision=request.use_vision,
+        stop_after="execute" if request.auto_execute else "generate"
+    )
+    
+    steps = {
+        "analysis": _analysis_dict(result.analysis),
+        "generation": _generation_dict(result.generated)
+    }
+    if result.execution:
+        steps["execution"] = _execution_dict(result.execution)
     
-    result = {
+    return {
         "url": request.url,
         "goal": request.goal,
-        "steps": {}
+        "steps": steps,
+        "page_title": result.page_title
     }
+
+
+async def _iter_ndjson(steps: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[bytes]:
+    """每完成一個步驟輸出一行 JSON；中途失敗時以 error 步驟結尾 (狀態碼已送出)"""
+    try:
+        async for step, value in steps:
+            yield dumps({"step": step, "data": _STEP_VIEWS[step](value)}) + b"\n"
+    except Exception as e:
+        yield dumps({"step": "error", "data": {"error": str(e)}}) + b"\n"
+
+
+@app.post("/full/stream")
+async def full_pipeline_stream(request: FullPipelineRequest, http_request: Request):
+    """
+    完整流程 (串流)：與 /full 相同，但每完成一個步驟就回傳一行 JSON (NDJSON)
     
-    # Step 1: 載入網頁
-    page_data = await browser_client.analyze_page(request.url)
-    result["page_title"] = page_data.title
+    前端不必等到執行完成，就能先顯示分析結果與程式碼
+    """
+    steps = iter_pipeline(
+        request.url, request.goal,
+        **_pipeline_clients(http_request),
+        use_vision=request.use_vision,
+        stop_after="execute" if request.auto_execute else "generate"
+    )
+    return StreamingResponse(_iter_ndjson(steps), media_type="application/x-ndjson")
+
+
+class _ZipChunkWriter(io.RawIOBase):
+    """
+    ZipFile 的寫入目標：暫存寫入的位元組，由 generator 逐段取出送給客戶端
+    不支援 seek，zipfile 會改用 data descriptor 格式，不需要把整個 ZIP 留在記憶體
+    """
     
-    # Step 2: 分析
-    analyzer = PageAnalyzer()
-    try:
-        analysis = await analyzer.analyze(
-            user_goal=request.goal,
-            page_title=page_data.title,
-            simplified_html=page_data.simplified_html,
-            screenshot_base64=page_data.screenshot_base64 if request.use_vision else None
-        )
-        result["steps"]["analysis"] = {
-            "target": analysis.target_description,
-            "selectors": analysis.suggested_selectors,
-            "structure": analysis.data_structure
-        }
-    finally:
-        await analyzer.close()
+    def __init__(self):
+        self._chunks: List[bytes] = []
     
-    # Step 3: 生成程式碼
-    generator = ScraperGenerator()
-    try:
-        code_result = await generator.generate(
-            url=request.url,
-            target_description=analysis.target_description,
-            selectors=analysis.suggested_selectors,
-            data_structure=analysis.data_structure,
-            page_type=analysis.page_type
-        )
-        result["steps"]["generation"] = {
-            "code": code_result.code,
-            "explanation": code_result.explanation
-        }
-    finally:
-        await generator.close()
+    def writable(self) -> bool:
+        return True
     
-    # Step 4: 執行 (如果啟用)
-    if request.auto_execute:
-        executor = SandboxExecutor()
-        exec_result = executor.execute(code_result.code, request.url)
-        result["steps"]["execution"] = {
-            "success": exec_result.success,
-            "data": exec_result.data if exec_result.success else None,
-            "error": exec_result.error if not exec_result.success else None
-        }
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
     
-    return result
-
-
-@app.post("/download")
-async def download_scraper(request: DownloadRequest):
-    """打包並下載爬蟲程式碼 (ZIP)"""
-    try:
-        # 0. 產生動態檔名 (e.g., scraper_stockq_org.zip)
-        from urllib.parse import urlparse
-        import re
-        
-        domain = urlparse(request.url).netloc
-        safe_domain = re.sub(r'[^a-zA-Z0-9]', '_', domain)
-        zip_filename = f"scraper_{safe_domain}"
-        
-        # 1. 準備檔案內容
-        files = {}
-        
-        # scraper.py (Inject PEP 723 Metadata for uv run support)
-        pep723_header = """# /// script
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_zip(files: Dict[str, str]) -> Iterator[bytes]:
+    """邊建立 ZIP 邊輸出，每寫完一個檔案就送出一段"""
+    writer = _ZipChunkWriter()
+    with zipfile.ZipFile(writer, "w") as zip_file:
+        for name, content in files.items():
+            data = content.encode("utf-8")
+            if len(data) > ZIP_DEFLATE_MIN_SIZE:
+                zip_file.writestr(name, data, zipfile.ZIP_DEFLATED, compresslevel=1)
+            else:
+                zip_file.writestr(name, data, zipfile.ZIP_STORED)
+            yield writer.drain()
+    # 結尾的 central directory
+    yield writer.drain()
+
+
+# ===== /download 打包的檔案範本 =====
+# 範本以 str.format_map 填入 {filename} / {url} / {domain} / {safe_domain}，
+# 字面上的大括號寫成 {{ }}
+
+# scraper.py 開頭的 PEP 723 metadata (支援 uv run)
+_PEP723_HEADER = """# /// script
 # requires-python = ">=3.11"
 # dependencies = [
+#     "httpx",
 #     "requests",
 #     "beautifulsoup4",
+#     "lxml",
 #     "pandas",
 #     "openpyxl",
 # ]
 # ///
 """
-        files[f"{request.filename}.py"] = pep723_header + "\n" + request.code
-        
-        # requirements.txt
-        files["requirements.txt"] = "requests\nbeautifulsoup4\npandas\nopenpyxl"
-        
-        # run.bat (支援 uv 或 fallback 到 venv, 使用 GOTO 避免括號問題)
-        files["run.bat"] = f"""@echo off
+
+_REQUIREMENTS_TXT = "httpx\nrequests\nbeautifulsoup4\nlxml\npandas\nopenpyxl"
+
+# run.bat (支援 uv 或 fallback 到 venv, 使用 GOTO 避免括號問題)
+_RUN_BAT_TMPL = """@echo off
 cd /d "%~dp0"
 echo [SmartScraper] Checking for 'uv' package manager...
 
@@ -365,8 +452,8 @@ goto USE_VENV
 
 :USE_UV
 echo [SmartScraper] 'uv' found! Using uv to run with isolated environment...
-echo [SmartScraper] Running: uv run {request.filename}.py
-uv run {request.filename}.py > result.txt 2>&1
+echo [SmartScraper] Running: uv run {filename}.py
+uv run {filename}.py > result.txt 2>&1
 goto DONE
 
 :USE_VENV
@@ -384,7 +471,7 @@ echo [SmartScraper] Installing dependencies into venv...
 pip install -r requirements.txt
 
 echo [SmartScraper] Running scraper...
-python {request.filename}.py > result.txt 2>&1
+python {filename}.py > result.txt 2>&1
 
 deactivate
 goto DONE
@@ -394,10 +481,10 @@ echo.
 echo [SmartScraper] Done! Output saved to result.txt
 pause
 """
-        
-        # setup_task.ps1 (自動排程)
-        files["setup_task.ps1"] = f"""$TaskName = "SmartScraper-{safe_domain}"
-$ScriptPath = "$PSScriptRoot\\{request.filename}.py"
+
+# setup_task.ps1 (自動排程)
+_SETUP_TASK_PS1_TMPL = """$TaskName = "SmartScraper-{safe_domain}"
+$ScriptPath = "$PSScriptRoot\\{filename}.py"
 
 # 檢查 uv
 $UVPath = (Get-Command uv -ErrorAction SilentlyContinue).Source
@@ -420,14 +507,14 @@ if ($UVPath) {{
 
 $Action = New-ScheduledTaskAction -Execute $ExePath -Argument $Args -WorkingDirectory $PSScriptRoot
 $Trigger = New-ScheduledTaskTrigger -Daily -At 9am
-Register-ScheduledTask -Action $Action -Trigger $Trigger -TaskName $TaskName -Description "Daily SmartScraper execution for {request.url}" -Force
+Register-ScheduledTask -Action $Action -Trigger $Trigger -TaskName $TaskName -Description "Daily SmartScraper execution for {url}" -Force
 
 Write-Host "Task '$TaskName' registered successfully to run daily at 9:00 AM." -ForegroundColor Green
 Write-Host "Logs will be saved to: $PSScriptRoot\\result.txt" -ForegroundColor Gray
 """
 
-        # setup_task.bat (Wrapper for visibility)
-        files["setup_task.bat"] = """@echo off
+# setup_task.bat (Wrapper for visibility)
+_SETUP_TASK_BAT = """@echo off
 cd /d "%~dp0"
 echo [SmartScraper] Setting up Windows Task Scheduler...
 powershell -NoProfile -ExecutionPolicy Bypass -File "setup_task.ps1"
@@ -442,10 +529,9 @@ echo.
 pause
 """
 
-        # README.md
-        files["README.md"] = f"""# 🕷️ {request.filename} ({domain})
+_README_TMPL = """# 🕷️ {filename} ({domain})
 
-Target: {request.url}
+Target: {url}
 
 ## 🚀 How to Run
 
@@ -469,17 +555,36 @@ To run this scraper every day at 09:00 AM:
 Results will be saved to `result.txt` in the same folder.
 """
 
-        # 2. 建立 ZIP
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for name, content in files.items():
-                zip_file.writestr(name, content)
-        
-        zip_buffer.seek(0)
+
+@app.post("/download")
+async def download_scraper(request: DownloadRequest):
+    """打包並下載爬蟲程式碼 (ZIP)"""
+    try:
+        # 0. 產生動態檔名 (e.g., scraper_stockq_org.zip)
+        domain = urlparse(request.url).netloc
+        safe_domain = _UNSAFE_FILENAME_CHARS.sub('_', domain)
+        zip_filename = f"scraper_{safe_domain}"
         
-        # 3. 回傳
+        # 1. 準備檔案內容
+        fields = {
+            "filename": request.filename,
+            "url": request.url,
+            "domain": domain,
+            "safe_domain": safe_domain
+        }
+        files = {
+            # scraper.py (Inject PEP 723 Metadata for uv run support)
+            f"{request.filename}.py": _PEP723_HEADER + "\n" + request.code,
+            "requirements.txt": _REQUIREMENTS_TXT,
+            "run.bat": _RUN_BAT_TMPL.format_map(fields),
+            "setup_task.ps1": _SETUP_TASK_PS1_TMPL.format_map(fields),
+            "setup_task.bat": _SETUP_TASK_BAT,
+            "README.md": _README_TMPL.format_map(fields)
+        }
+
+        # 2. 邊建立 ZIP 邊回傳
         return StreamingResponse(
-            zip_buffer,
+            _iter_zip(files),
             media_type="application/zip",
             headers={"Content-Disposition": f'attachment; filename="{zip_filename}.zip"'}
         )
@@ -494,4 +599,15 @@ Results will be saved to `result.txt` in the same folder.
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8081)
+    
+    # 多 worker 時每個 process 各自啟動瀏覽器與沙箱 pool (預設單一 process 方便開發)
+    # loop / http 為 auto: 已安裝 uvloop、httptools 時自動使用
+    workers = settings.workers
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8081,
+        workers=workers,
+        loop="auto",
+        http="auto"
+    )
@@ -2,12 +2,26 @@
 沙箱執行器
 安全地執行 AI 生成的爬蟲程式碼
 """
-import sys
-import io
-from typing import Any, Dict, Optional
+import re
+import ast
+import json
+import asyncio
+import signal
+import inspect
+import marshal
+import builtins
+import threading
+import multiprocessing
+from datetime import datetime
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import traceback
 
+import httpx
+import requests
+from bs4 import BeautifulSoup
+
 
 @dataclass
 class ExecutionResult:
@@ -19,105 +33,445 @@ class ExecutionResult:
 
 
 # 允許的模組白名單
-ALLOWED_MODULES = {
+ALLOWED_MODULES = frozenset({
+    "httpx",
+    "asyncio",
     "requests",
     "bs4",
     "BeautifulSoup",
+    "lxml",
     "json",
     "re",
     "datetime",
     "time",
-}
+})
+
+# 危險關鍵字 (單一 regex，只掃描程式碼一次；AST 檢查之外的第一道防線)
+_DANGEROUS_RE = re.compile(r"os\.|subprocess|socket|eval\(|exec\(")
+
+# 禁止匯入的模組 (AST 檢查時直接拒絕，不必等到執行)
+_BANNED_MODULES = frozenset({
+    "os", "sys", "subprocess", "socket", "shutil",
+    "ctypes", "pickle", "marshal", "importlib", "builtins",
+})
+
+# 禁止的屬性 (只比對屬性與 from-import 的名稱，變數名稱如 system_name、executor 不受影響)：
+# 執行外部程式的函數，以及透過 frame 取回 globals / builtins 的路徑
+# (底線開頭的屬性如 __globals__、random._os 另外一律拒絕)
+_BANNED_ATTRIBUTES = frozenset({
+    "system", "popen", "Popen", "fork", "forkpty", "startfile",
+    "execl", "execle", "execlp", "execlpe", "execv", "execve", "execvp", "execvpe",
+    "spawnl", "spawnle", "spawnlp", "spawnlpe", "spawnv", "spawnve", "spawnvp", "spawnvpe",
+    "posix_spawn", "posix_spawnp",
+    "create_subprocess_exec", "create_subprocess_shell",
+    "f_globals", "f_locals", "f_builtins", "f_back",
+    "gi_frame", "cr_frame", "ag_frame", "tb_frame",
+})
 
 # 禁止的內建函數
-BLOCKED_BUILTINS = {
+BLOCKED_BUILTINS = frozenset({
     "exec", "eval", "compile",
     "open", "input",
     "__import__",
     "globals", "locals",
     "getattr", "setattr", "delattr",
     "breakpoint",
+})
+
+
+# 禁止出現的名稱 (即使 builtins 已移除，也在執行前就拒絕)
+_BANNED_NAMES = BLOCKED_BUILTINS | frozenset({"vars"})
+
+
+class _SandboxViolation(Exception):
+    """程式碼使用了禁止的模組、函數或屬性"""
+
+
+def _check_identifier(name: str) -> None:
+    """
+    名稱或屬性以底線開頭或是禁止的模組 (e.g. requests.utils.os) 時拋出 _SandboxViolation
+    模組不必 import 也可能經由其他模組的私有屬性取得 (e.g. random._os、httpx._api.typing)，
+    所以每個名稱都要檢查；單獨的 "_" (捨棄用的變數) 不受限制
+    """
+    if name.startswith("_") and name != "_":
+        raise _SandboxViolation(f"禁止使用底線開頭的名稱: {name}")
+    if name in _BANNED_MODULES:
+        raise _SandboxViolation(f"禁止使用模組: {name}")
+
+
+def _check_tree(tree: ast.AST) -> bool:
+    """
+    走訪 AST 一次，找到禁止的 import、名稱或屬性時拋出 _SandboxViolation
+
+    Returns:
+        程式碼是否使用 print (沒有時執行不需要捕獲 stdout)
+    """
+    uses_print = False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id == "print":
+                uses_print = True
+                continue
+            if node.id in _BANNED_NAMES:
+                raise _SandboxViolation(f"禁止使用危險函數: {node.id}")
+            _check_identifier(node.id)
+        elif isinstance(node, ast.Attribute):
+            if node.attr in _BANNED_ATTRIBUTES:
+                raise _SandboxViolation(f"禁止存取屬性: {node.attr}")
+            _check_identifier(node.attr)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            else:
+                modules = ["." * node.level + (node.module or "")]
+                # from asyncio import create_subprocess_shell / from requests.utils import os
+                for alias in node.names:
+                    if alias.name in _BANNED_ATTRIBUTES:
+                        raise _SandboxViolation(f"禁止存取屬性: {alias.name}")
+                    _check_identifier(alias.name)
+            for module in modules:
+                # 任何一層是禁止的模組都拒絕 (e.g. asyncio.subprocess)
+                if any(part in _BANNED_MODULES for part in module.split(".")):
+                    raise _SandboxViolation(f"禁止匯入模組: {module}")
+                # 不在白名單的 import 執行時一定失敗，不必啟動子 process
+                if not _is_allowed_import(module):
+                    raise _SandboxViolation(f"ImportError: Sandbox Restriction: Module '{module}' is not allowed.")
+    return uses_print
+
+
+# 編譯結果快取筆數 (重試、/fix 後重新執行常會送來相同的程式碼)
+COMPILE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile(code: str) -> Tuple[Optional[bytes], bool, Optional[str]]:
+    """
+    解析、檢查並編譯程式碼
+    檢查與編譯共用同一棵 AST，程式碼只解析一次；相同程式碼重複執行時直接重用
+    (失敗的結果也一併快取，lru_cache 不會快取例外)
+
+    Returns:
+        (marshal 序列化的 code object (可傳給子 process), 是否使用 print, 錯誤訊息)，
+        code object 與錯誤訊息其一為 None
+    """
+    match = _DANGEROUS_RE.search(code)
+    if match:
+        return None, False, f"禁止使用危險關鍵字: {match.group(0)}"
+    
+    try:
+        tree = ast.parse(code, "<sandbox>")
+        uses_print = _check_tree(tree)
+        # optimize=2: 去除 assert 與 docstring (產生的程式碼只執行一次，不需要)
+        code_obj = compile(tree, "<sandbox>", "exec", optimize=2)
+        return marshal.dumps(code_obj), uses_print, None
+    except _SandboxViolation as e:
+        return None, False, str(e)
+    except (SyntaxError, ValueError) as e:
+        return None, False, f"{type(e).__name__}: {e}"
+
+
+# 允許 import 的模組清單 (支援子模組字串比對)
+ALLOWED_IMPORTS = frozenset({
+    "httpx",
+    "asyncio",
+    "requests",
+    "bs4",
+    "lxml",
+    "json",
+    "re",
+    "datetime",
+    "time",
+    "typing",
+    "collections",
+    "urllib",
+    "urllib.parse",
+    "urllib.request",
+    "urllib.error",
+    "math",
+    "random"
+})
+
+
+def _is_allowed_import(name: str) -> bool:
+    # 處理 name (e.g., 'urllib.parse')
+    return name in ALLOWED_IMPORTS or name.split('.')[0] in ALLOWED_IMPORTS
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """受限的 __import__"""
+    if _is_allowed_import(name):
+        # 這是安全的，呼叫原始 __import__
+        return __import__(name, globals, locals, fromlist, level)
+    
+    raise ImportError(f"Sandbox Restriction: Module '{name}' is not allowed.")
+
+
+# 受限的 builtins 與預設 globals 只在 import 時建立一次
+# 直接讀取模組的 __dict__ (dir() 會另外排序，並需要逐一 getattr)
+_SAFE_BUILTINS = {
+    name: value
+    for name, value in vars(builtins).items()
+    if name not in BLOCKED_BUILTINS and not name.startswith("_")
 }
+_SAFE_BUILTINS["__import__"] = _safe_import
+
+# 預先匯入常用模組方便使用 (Optional, 但為了相容性保留)
+_BASE_GLOBALS = {
+    "__name__": "__main__",
+    "httpx": httpx,
+    "asyncio": asyncio,
+    "requests": requests,
+    "BeautifulSoup": BeautifulSoup,
+    "json": json,
+    "re": re,
+    "datetime": datetime,
+    "print": print,
+}
+
+
+class _OutputBuffer:
+    """
+    print 的輸出目標：只把片段存進 list，結束時一次 join
+    (StringIO 每次寫入都要維護內部緩衝區，這裡只是 append)
+    """
+    __slots__ = ("_parts",)
+    
+    def __init__(self):
+        self._parts = []
+    
+    def write(self, text: str) -> int:
+        self._parts.append(text)
+        return len(text)
+    
+    def flush(self) -> None:
+        pass
+    
+    def getvalue(self) -> str:
+        return "".join(self._parts)
 
 
 def create_safe_globals() -> Dict:
     """
     建立安全的 globals 環境
+    globals 每次複製一份；builtins 直接共用 (每次執行都在獨立的子 process，
+    程式碼改動 builtins 也不會影響下一次執行)
     """
-    import builtins
-    
-    # 允許的模組清單 (支援子模組字串比對)
-    ALLOWED_IMPORTS = {
-        "requests",
-        "bs4",
-        "json",
-        "re",
-        "datetime",
-        "time",
-        "typing",
-        "collections",
-        "urllib",
-        "urllib.parse",
-        "urllib.request",
-        "urllib.error",
-        "math",
-        "random"
-    }
-    
-    # 受限的 __import__
-    def safe_import(name, globals=None, locals=None, fromlist=(), level=0):
-        # 處理 name (e.g., 'urllib.parse')
-        base_name = name.split('.')[0]
+    exec_globals = _BASE_GLOBALS.copy()
+    exec_globals["__builtins__"] = _SAFE_BUILTINS
+    return exec_globals
+
+
+# httpx 第一次送出請求時才 import 的模組 (連線層、HTTP/1.1 與 HTTP/2、asyncio backend)，
+# 在 forkserver 預先載入，子 process 不必每次重新 import
+_PRELOAD_MODULES = [
+    "httpcore",
+    "h11",
+    "h2.connection",
+    "anyio._backends._asyncio",
+]
+
+# 子 process 的啟動方式：forkserver 從預先載入主程式與本模組的乾淨 process fork，
+# 不會複製 server 的執行緒與狀態，每次啟動只需數毫秒 (Windows 沒有 forkserver，改用 spawn)
+# 與 multiprocessing 相同，主程式需以 if __name__ == "__main__" 保護進入點
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _MP = multiprocessing.get_context("forkserver")
+    _MP.set_forkserver_preload(["__main__", "sandbox.executor", *_PRELOAD_MODULES])
+else:
+    _MP = multiprocessing.get_context("spawn")
+
+
+# 預先啟動、待命的子 process 數
+STANDBY_PROCESSES = 2
+
+# 子 process 軟性逾時後，父 process 再等待幾秒才強制終止
+# (讓子 process 有時間回傳已收集的 stdout)
+KILL_GRACE_SECONDS = 2
+
+
+class _ExecutionTimeout(BaseException):
+    """軟性逾時 (繼承 BaseException，不會被程式碼中的 except Exception 吞掉)"""
+
+
+def _raise_timeout(signum, frame):
+    raise _ExecutionTimeout()
+
+
+def _run_program(program: bytes, uses_print: bool, url: str, timeout: float) -> ExecutionResult:
+    """在目前的 process 執行 _compile() 產生的程式碼 (由子 process 呼叫)"""
+    # 捕獲 stdout：注入寫入 buffer 的 print，不修改全域的 sys.stdout
+    # (程式碼沒有使用 print 時不注入，buffer 維持空的)
+    captured_output = _OutputBuffer()
+    
+    # 軟性逾時 (POSIX)：時間到時在程式碼中拋出例外，保留已輸出的 stdout；
+    # Windows 沒有 SIGALRM，只靠父 process 強制終止
+    use_alarm = hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    
+    try:
+        # 建立安全環境
+        # 重要：使用同一個 dict 作為 globals 和 locals
+        # 這樣函數之間才能互相呼叫
+        exec_globals = create_safe_globals()
+        if uses_print:
+            exec_globals["print"] = partial(print, file=captured_output)
         
-        if name in ALLOWED_IMPORTS or base_name in ALLOWED_IMPORTS:
-            # 這是安全的，呼叫原始 __import__
-            return __import__(name, globals, locals, fromlist, level)
+        # 執行程式碼 (定義函數)
+        # 只傳一個 dict，這樣定義的函數會在同一個 namespace
+        exec(marshal.loads(program), exec_globals)
         
-        raise ImportError(f"Sandbox Restriction: Module '{name}' is not allowed.")
-    
-    # 建立受限的 builtins
-    safe_builtins = {}
-    for name in dir(builtins):
-        if name not in BLOCKED_BUILTINS and not name.startswith("_"):
-            try:
-                safe_builtins[name] = getattr(builtins, name)
-            except:
-                pass
-    
-    # 加入受限的 __import__
-    safe_builtins["__import__"] = safe_import
-    
-    # 預先匯入常用模組方便使用 (Optional, 但為了相容性保留)
-    import requests
-    from bs4 import BeautifulSoup
-    import json
-    import re
-    from datetime import datetime
-    
-    return {
-        "__builtins__": safe_builtins,
-        "__name__": "__main__",
-        "requests": requests,
-        "BeautifulSoup": BeautifulSoup,
-        "json": json,
-        "re": re,
-        "datetime": datetime,
-        "print": print,
-    }
+        # 呼叫 scrape 函數
+        if "scrape" not in exec_globals:
+            return ExecutionResult(
+                success=False,
+                error="程式碼必須定義 scrape(url) 函數"
+            )
+        
+        scrape_func = exec_globals["scrape"]
+        if inspect.iscoroutinefunction(scrape_func):
+            # async def scrape: 在子 process 中建立自己的 event loop 執行
+            result = asyncio.run(scrape_func(url))
+        else:
+            result = scrape_func(url)
+        
+        return ExecutionResult(
+            success=True,
+            data=result,
+            stdout=captured_output.getvalue()
+        )
+        
+    except _ExecutionTimeout:
+        return ExecutionResult(
+            success=False,
+            error=f"執行逾時: 超過 {timeout} 秒未完成",
+            stdout=captured_output.getvalue()
+        )
+        
+    except ModuleNotFoundError as e:
+        # 提供安裝指令
+        module_name = e.name or str(e)
+        install_hints = {
+            "bs4": "uv add beautifulsoup4",
+            "beautifulsoup4": "uv add beautifulsoup4",
+            "requests": "uv add requests",
+        }
+        install_cmd = install_hints.get(module_name, f"uv add {module_name}")
+        
+        return ExecutionResult(
+            success=False,
+            error=f"缺少模組: {module_name}\n\n請執行安裝指令:\n{install_cmd}",
+            stdout=captured_output.getvalue()
+        )
+        
+    except Exception as e:
+        error_msg = f"{type(e).__name__}: {str(e)}"
+        
+        # 簡化錯誤訊息，不要整個 traceback
+        if "scrape" in str(e):
+            error_msg = "程式碼執行錯誤，請檢查 scrape() 函數"
+        
+        return ExecutionResult(
+            success=False,
+            error=error_msg,
+            stdout=captured_output.getvalue()
+        )
+    
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _standby_main(conn) -> None:
+    """
+    待命子 process 的進入點：等待一份工作 (program, uses_print, url, timeout)，
+    執行後把結果送回父 process 並結束 (每個 process 只執行一次，執行之間不共用狀態)
+    """
+    try:
+        program, uses_print, url, timeout = conn.recv()
+    except EOFError:
+        # 父 process 關閉了 pipe (縮減待命數或 server 結束)
+        return
+    
+    result = _run_program(program, uses_print, url, timeout)
+    try:
+        conn.send(result)
+    except Exception as e:
+        # 回傳的資料無法 pickle (e.g. 含有 generator、lock)
+        conn.send(ExecutionResult(
+            success=False,
+            error=f"無法回傳 scrape() 的結果: {type(e).__name__}: {e}",
+            stdout=result.stdout
+        ))
+    finally:
+        conn.close()
 
 
 class SandboxExecutor:
     """
     沙箱執行器
-    在受限環境中執行程式碼
+    在受限環境中執行程式碼，每次執行使用獨立的子 process，
+    超過 timeout 秒時強制終止 (無窮迴圈、卡住的連線都不會拖住 server)
+
+    子 process 預先啟動並待命 (模組已載入)，取用一個就在背景補上一個，
+    啟動 process 的時間不在請求路徑上
     """
     
-    def __init__(self, timeout: int = 30):
+    def __init__(self, timeout: int = 30, standby: int = STANDBY_PROCESSES):
         self.timeout = timeout
+        self.standby = standby
+        self._standby: List[Tuple[Any, Any]] = []  # (process, connection)
+        self._lock = threading.Lock()
+    
+    def start(self) -> None:
+        """預先啟動待命的子 process (第一次執行也不必等待啟動)"""
+        self._refill()
+    
+    def close(self) -> None:
+        """結束所有待命的子 process"""
+        with self._lock:
+            standby, self._standby = self._standby, []
+        for process, conn in standby:
+            conn.close()
+            process.join(timeout=1)
+            if process.is_alive():
+                process.kill()
+    
+    def _spawn(self) -> Tuple[Any, Any]:
+        conn, child_conn = _MP.Pipe()
+        process = _MP.Process(target=_standby_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+    
+    def _acquire(self) -> Tuple[Any, Any]:
+        """取得一個待命的子 process，沒有時立即啟動一個"""
+        with self._lock:
+            while self._standby:
+                process, conn = self._standby.pop()
+                if process.is_alive():
+                    return process, conn
+                conn.close()
+        return self._spawn()
+    
+    def _refill(self) -> None:
+        """補足待命的子 process"""
+        while True:
+            with self._lock:
+                if len(self._standby) >= self.standby:
+                    return
+            worker = self._spawn()
+            with self._lock:
+                if len(self._standby) < self.standby:
+                    self._standby.append(worker)
+                    continue
+            # 其他執行緒已經補滿，關閉 pipe 讓這個 process 結束
+            worker[1].close()
+            return
     
     def execute(self, code: str, url: str) -> ExecutionResult:
         """
-        執行爬蟲程式碼
+        執行爬蟲程式碼 (阻塞直到完成或逾時)
         
         Args:
             code: Python 程式碼
@@ -126,75 +480,36 @@ class SandboxExecutor:
         Returns:
             ExecutionResult
         """
-        # 捕獲 stdout
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = io.StringIO()
+        # 語法錯誤與禁止的用法不需要啟動子 process 就能拒絕
+        program, uses_print, error = _compile(code)
+        if error:
+            return ExecutionResult(success=False, error=error)
         
+        process, conn = self._acquire()
         try:
-            # 檢查危險關鍵字
-            dangerous_keywords = ["os.", "subprocess", "socket", "eval(", "exec("]
-            for keyword in dangerous_keywords:
-                if keyword in code:
-                    return ExecutionResult(
-                        success=False,
-                        error=f"禁止使用危險關鍵字: {keyword}"
-                    )
-            
-            # 建立安全環境
-            # 重要：使用同一個 dict 作為 globals 和 locals
-            # 這樣函數之間才能互相呼叫
-            exec_globals = create_safe_globals()
-            
-            # 執行程式碼 (定義函數)
-            # 只傳一個 dict，這樣定義的函數會在同一個 namespace
-            exec(code, exec_globals)
+            conn.send((program, uses_print, url, self.timeout))
+            # 程式碼執行的同時補上待命的子 process
+            self._refill()
             
-            # 呼叫 scrape 函數
-            if "scrape" not in exec_globals:
+            # 先讀取結果再 join：結果很大時子 process 會卡在寫入 pipe，不能先 join
+            if not conn.poll(self.timeout + KILL_GRACE_SECONDS):
                 return ExecutionResult(
                     success=False,
-                    error="程式碼必須定義 scrape(url) 函數"
+                    error=f"執行逾時: 超過 {self.timeout} 秒未完成，已強制終止"
                 )
-            
-            scrape_func = exec_globals["scrape"]
-            result = scrape_func(url)
-            
-            return ExecutionResult(
-                success=True,
-                data=result,
-                stdout=captured_output.getvalue()
-            )
-            
-        except ModuleNotFoundError as e:
-            # 提供安裝指令
-            module_name = str(e).split("'")[1] if "'" in str(e) else str(e)
-            install_hints = {
-                "bs4": "uv add beautifulsoup4",
-                "beautifulsoup4": "uv add beautifulsoup4",
-                "requests": "uv add requests",
-            }
-            install_cmd = install_hints.get(module_name, f"uv add {module_name}")
-            
-            return ExecutionResult(
-                success=False,
-                error=f"缺少模組: {module_name}\n\n請執行安裝指令:\n{install_cmd}",
-                stdout=captured_output.getvalue()
-            )
-            
-        except Exception as e:
-            error_msg = f"{type(e).__name__}: {str(e)}"
-            
-            # 簡化錯誤訊息，不要整個 traceback
-            if "scrape" in str(e):
-                error_msg = "程式碼執行錯誤，請檢查 scrape() 函數"
-            
+            return conn.recv()
+        except (EOFError, OSError):
+            # 子 process 沒有回傳結果就結束 (e.g. 記憶體不足被系統終止)
+            process.join()
             return ExecutionResult(
                 success=False,
-                error=error_msg,
-                stdout=captured_output.getvalue()
+                error=f"沙箱 process 異常結束 (exit code {process.exitcode})"
             )
         finally:
-            sys.stdout = old_stdout
+            conn.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
 
 
 # 測試
@@ -208,7 +523,7 @@ from bs4 import BeautifulSoup
 
 def scrape(url):
     response = requests.get(url, timeout=10)
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = BeautifulSoup(response.text, 'lxml')
     title = soup.find('title')
     return {"title": title.text if title else "N/A"}
 '''
@@ -1,11 +1,33 @@
 import sys
-import os
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import io
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import re
 import zipfile
+import tempfile
 import asyncio
+import anyio
 from main import download_scraper, DownloadRequest
 
+# 各檔案要檢查的內容 (每個檔案只掃描一次，再看找到了哪些)
+_PY_CHECKS = re.compile(r"# /// script|requests")
+_BAT_CHECKS = re.compile(r"goto USE_UV|:USE_UV")
+_PS1_CHECKS = re.compile(r"SmartScraper-www_stockq_org|cmd\.exe|> result\.txt")
+
+# ZIP 超過此大小時改寫入暫存檔，不全部留在記憶體
+SPOOL_MAX_SIZE = 16 << 20
+
+# 下載 ZIP 的時間上限 (秒)，endpoint 卡住時不會一直等下去
+RECEIVE_TIMEOUT = 30
+
+async def _receive(body_iterator, spool):
+    """把 StreamingResponse 的內容寫入 spool，並回到開頭 (超過 RECEIVE_TIMEOUT 秒時拋出 TimeoutError)"""
+    with anyio.move_on_after(RECEIVE_TIMEOUT) as scope:
+        async for chunk in body_iterator:
+            spool.write(chunk)
+    if scope.cancelled_caught:
+        raise TimeoutError(f"下載 ZIP 超過 {RECEIVE_TIMEOUT} 秒未完成")
+    spool.seek(0)
+
 async def verify():
     print("🔍 Starting Package Verification...")
     
@@ -23,29 +45,29 @@ async def verify():
         response = await download_scraper(request)
         
         # 3. Extract ZIP from StreamingResponse
-        content = b""
-        async for chunk in response.body_iterator:
-            content += chunk
-            
-        zip_buffer = io.BytesIO(content)
+        # ZIP 的目錄在檔案結尾，必須收完才能解析；
+        # 邊收邊寫入 spool (小的留在記憶體，大的轉存暫存檔)
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        await _receive(response.body_iterator, spool)
         
-        with zipfile.ZipFile(zip_buffer, 'r') as z:
+        with spool, zipfile.ZipFile(spool, 'r') as z:
             file_list = z.namelist()
             print(f"📂 Files in ZIP: {file_list}")
+            names = set(file_list)
             
             # Check 1: Check if scraper.py exists and valid
-            if "scraper.py" in file_list:
-                py_content = z.read("scraper.py").decode('utf-8')
-                if "# /// script" in py_content and "requests" in py_content:
+            if "scraper.py" in names:
+                found = set(_PY_CHECKS.findall(z.read("scraper.py").decode('utf-8')))
+                if {"# /// script", "requests"} <= found:
                     print("✅ scraper.py: PEP 723 Metadata found (uv run support confirmed).")
                 else:
                     print("❌ scraper.py: PEP 723 Metadata MISSING!")
                     sys.exit(1)
             
             # Check 2: run.bat GOTO syntax
-            if "run.bat" in file_list:
-                bat_content = z.read("run.bat").decode('utf-8')
-                if "goto USE_UV" in bat_content and ":USE_UV" in bat_content:
+            if "run.bat" in names:
+                found = set(_BAT_CHECKS.findall(z.read("run.bat").decode('utf-8')))
+                if {"goto USE_UV", ":USE_UV"} <= found:
                      print("✅ run.bat: GOTO syntax found (Fix Verified).")
                 else:
                      print("❌ run.bat: GOTO syntax MISSING!")
@@ -55,15 +77,15 @@ async def verify():
                  sys.exit(1)
 
             # Check 3: setup_task.ps1 dynamic name & CMD wrapper
-            if "setup_task.ps1" in file_list:
-                ps1_content = z.read("setup_task.ps1").decode('utf-8')
-                if "SmartScraper-www_stockq_org" in ps1_content:
+            if "setup_task.ps1" in names:
+                found = set(_PS1_CHECKS.findall(z.read("setup_task.ps1").decode('utf-8')))
+                if "SmartScraper-www_stockq_org" in found:
                     print("✅ setup_task.ps1: Dynamic TaskName found (www_stockq_org).")
                 else:
                     print(f"❌ setup_task.ps1: Dynamic TaskName MISSING!")
                     sys.exit(1)
                 
-                if 'cmd.exe' in ps1_content and '> result.txt' in ps1_content:
+                if {"cmd.exe", "> result.txt"} <= found:
                     print("✅ setup_task.ps1: CMD wrapper logic found (Redirects to result.txt).")
                 else:
                     print(f"❌ setup_task.ps1: CMD wrapper logic MISSING!")
@@ -0,0 +1,146 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ast
+import tempfile
+from sandbox.executor import SandboxExecutor, _check_tree, _SandboxViolation
+
+# 曾經成功執行 shell 指令的程式碼 (regression)
+_ESCAPES = {
+    "requests.utils.os.popen": '''import requests
+
+def scrape(url):
+    return requests.utils.os.popen("echo PWNED").read()
+''',
+    "asyncio.create_subprocess_shell": '''import asyncio
+
+async def scrape(url):
+    proc = await asyncio.create_subprocess_shell("echo PWNED", stdout=asyncio.subprocess.PIPE)
+    out, _ = await proc.communicate()
+    return out.decode()
+''',
+    "random._os": '''import random
+
+def scrape(url):
+    return random._os.listdir("/")
+''',
+}
+
+# 不含 regex 關鍵字、只能靠 AST 檢查擋下的變形
+_AST_ONLY_ESCAPES = {
+    "module via attribute": '''import requests
+
+def scrape(url):
+    m = requests.utils.os
+    return m.popen("echo PWNED").read()
+''',
+    "from-import of a module": '''from requests.utils import os as o
+
+def scrape(url):
+    return o.popen("echo PWNED").read()
+''',
+    "sys.modules via attribute": '''import requests
+
+def scrape(url):
+    return requests.utils.sys.modules["o" + "s"].popen("echo PWNED").read()
+''',
+    "private module chain": '''import httpx
+
+def scrape(url):
+    m = httpx._client.logging.threading._os
+    return m.posix_spawnp("sh", ["sh", "-c", "echo PWNED"], {})
+''',
+    "sys.modules via private attribute": '''import httpx
+
+def scrape(url):
+    return httpx._api.typing.collections._sys.modules["o" + "s"].remove(url)
+''',
+}
+
+# 一般的爬蟲程式碼仍可執行
+_ALLOWED = '''import asyncio
+from bs4 import BeautifulSoup
+
+async def scrape(url):
+    await asyncio.sleep(0)
+    soup = BeautifulSoup("<p>ok</p>", "lxml")
+    return [{"text": soup.p.text, "url": url}]
+'''
+
+# 名稱中含有 exec / system 等字樣的一般變數不受影響
+_ALLOWED_NAMES = '''import time
+
+def scrape(url):
+    execution_count = 1
+    executor = {"system_name": "linux"}
+    execute_time = time.time()
+    for _ in range(2):
+        execution_count += 1
+    return [execution_count, executor["system_name"], execute_time > 0]
+'''
+
+
+def _rejected_by_ast(code: str) -> bool:
+    try:
+        _check_tree(ast.parse(code))
+    except _SandboxViolation:
+        return True
+    return False
+
+
+def verify():
+    print("🔍 Starting Sandbox Verification...")
+    executor = SandboxExecutor(timeout=10)
+    failed = False
+
+    try:
+        for name, code in _ESCAPES.items():
+            result = executor.execute(code, "https://example.com")
+            if result.success or "PWNED" in str(result.data) or "PWNED" in result.stdout:
+                print(f"❌ {name}: executed in the sandbox! ({result})")
+                failed = True
+            elif not _rejected_by_ast(code):
+                print(f"❌ {name}: not rejected by the AST check")
+                failed = True
+            else:
+                print(f"✅ {name}: rejected ({result.error})")
+
+        # 檔案刪除類的變形以暫存檔確認沒有被執行
+        marker = tempfile.NamedTemporaryFile(delete=False)
+        marker.close()
+        for name, code in _AST_ONLY_ESCAPES.items():
+            result = executor.execute(code, marker.name)
+            if result.success or not _rejected_by_ast(code):
+                print(f"❌ {name}: not rejected by the AST check ({result})")
+                failed = True
+            else:
+                print(f"✅ {name}: rejected ({result.error})")
+        if not Path(marker.name).exists():
+            print("❌ Marker file was deleted by sandboxed code!")
+            failed = True
+        Path(marker.name).unlink(missing_ok=True)
+
+        result = executor.execute(_ALLOWED, "https://example.com")
+        if result.success and result.data == [{"text": "ok", "url": "https://example.com"}]:
+            print("✅ Ordinary scraper still runs.")
+        else:
+            print(f"❌ Ordinary scraper failed: {result}")
+            failed = True
+
+        result = executor.execute(_ALLOWED_NAMES, "https://example.com")
+        if result.success and result.data == [3, "linux", True]:
+            print("✅ Names like execution_count / executor / system_name are allowed.")
+        else:
+            print(f"❌ Ordinary names rejected: {result}")
+            failed = True
+    finally:
+        executor.close()
+
+    if failed:
+        print("❌ Verification FAILED")
+        sys.exit(1)
+    print(f"\n🎉 Verification PASSED!")
+
+
+if __name__ == "__main__":
+    verify()